@@ -1,18 +1,37 @@
-import asyncio, re
-from collections import Counter
+import os
+import json
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
-import psycopg2.extras
 
-from scanner.crawler import run_scan
-from scanner.detector import detect, get_company
-from scanner.db import get_conn, upsert_website, insert_detection
+from scanner.service import ScanService
+from scanner.detector import load_engine
+from scanner.db import pooled_conn, technology_counts, technology_names, websites_page, decode_tech_bits
+from scanner import metrics
 
 load_dotenv()
 
-app = FastAPI(title="Website Tech Snapshot API")
+SCAN_BATCH_MAX = int(os.getenv("SCAN_BATCH_MAX", "100"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # DB rules have to be in place before the first scan creates the detection executor
+    try:
+        with pooled_conn() as conn:
+            load_engine(conn)
+    except Exception as e:
+        print(f"[!] Using built-in detection rules: {e}")
+    # one HTTP session, throttle and result cache for every request
+    app.state.scans = ScanService()
+    await app.state.scans.start()
+    yield
+    await app.state.scans.close()
+
+app = FastAPI(title="Website Tech Snapshot API", lifespan=lifespan)
 
 origins = ["http://localhost:3001", "http://127.0.0.1:3001"]
 app.add_middleware(
@@ -25,48 +44,79 @@ app.add_middleware(
 
 class ScanRequest(BaseModel):
     domain: str
+    fresh: bool = False
 
-def get_title(html: str) -> str | None:
-    m = re.search(r"<title>(.*?)</title>", html, re.I | re.S)
-    return m.group(1).strip() if m else None
+class BatchScanRequest(BaseModel):
+    domains: list[str]
+    fresh: bool = False
 
 @app.post("/api/scan")
 async def api_scan(req: ScanRequest):
     domain = req.domain.strip()
     if not domain:
         raise HTTPException(status_code=400, detail="domain required")
+    return await app.state.scans.scan(domain, fresh=req.fresh)
+
+@app.post("/api/scan/batch")
+async def api_scan_batch(req: BatchScanRequest):
+    """Scan several domains, streaming one JSON line per domain (NDJSON) as each finishes."""
+    domains = list(dict.fromkeys(d.strip().lower() for d in req.domains if d.strip()))
+    if not domains:
+        raise HTTPException(status_code=400, detail="domains required")
+    if len(domains) > SCAN_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"at most {SCAN_BATCH_MAX} domains per batch")
+
+    async def scan_one(domain):
+        try:
+            return await app.state.scans.scan(domain, fresh=req.fresh)
+        except Exception as e:
+            return {"domain": domain, "status": "error", "error": f"{type(e).__name__}: {e}"}
+
+    async def results():
+        tasks = [asyncio.create_task(scan_one(d)) for d in domains]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done) + "\n"
+        finally:
+            # if the client disconnects, stop waiting; the scans themselves still finish and get cached
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+def _techs(limit):
+    with pooled_conn() as conn:
+        return technology_counts(conn, limit)
+
+@app.get("/api/techs")
+async def api_techs(limit: int = Query(200, ge=1, le=1000)):
+    """Technologies by number of websites using them."""
+    return {"techs": await asyncio.to_thread(_techs, limit)}
+
+def _websites(techs, after, limit):
+    with pooled_conn() as conn:
+        names = technology_names(conn)
+        by_name = {name.lower(): tid for tid, name in names.items()}
+        wanted = [by_name.get(t.strip().lower()) for t in techs]
+        if None in wanted:
+            return []  # nobody uses a technology we've never seen
+        rows = websites_page(conn, wanted, after, limit)
+    return [
+        {"id": r["id"], "domain": r["domain"], "company": r["company_name"], "hosting": r["hosting"],
+         "techs": sorted(names[i] for i in decode_tech_bits(r["tech_bits"]) if i in names)}
+        for r in rows
+    ]
+
+@app.get("/api/websites")
+async def api_websites(tech: list[str] = Query([]), after: int = 0, limit: int = Query(100, ge=1, le=1000)):
+    """Websites using every `tech` given, in id order. Pass the returned next_after as `after` for the next page."""
+    websites = await asyncio.to_thread(_websites, tech, after, limit)
+    return {"websites": websites, "next_after": websites[-1]["id"] if len(websites) == limit else None}
 
-    results = await run_scan([domain], concurrency=1)
-    res = results[0]
-    url = res.get("url") or f"https://{domain}"
-
-    if res.get("ok"):
-        html = res["text"]
-        title = get_title(html)
-        detected = detect(html, {})
-
-        def save_success():
-            conn = get_conn()
-            wid = upsert_website(conn, domain, url, "ok", res.get("status"), title)
-            insert_detection(conn, wid, detected["cms"], detected["js_libs"], detected["analytics"], detected["custom_tags"], detected)
-            conn.close()
-            return wid
-
-        wid = await asyncio.to_thread(save_success)
-        return {"domain": domain, "url": url, "status": "ok", "detected": detected, "website_id": wid}
-
-    else:
-        error_msg = res.get("error", "Unknown fetch error")
-
-        def save_error():
-            conn = get_conn()
-            wid = upsert_website(conn, domain, url, "error", res.get("status"), None)
-            insert_detection(conn, wid, [], [], [], [], {"error": error_msg})
-            conn.close()
-            return wid
-
-        wid = await asyncio.to_thread(save_error)
-        return {"domain": domain, "url": url, "status": "error", "error": error_msg, "website_id": wid}
+@app.get("/api/metrics", response_class=PlainTextResponse)
+async def api_metrics():
+    """Scanner metrics for this process in Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/api/health")
 async def health():
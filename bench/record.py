@@ -0,0 +1,61 @@
+# bench/record.py
+"""Add a live page to the benchmark corpus.
+
+    python -m bench.record example.com [name] [--weight N]
+
+Saves the body (up to the crawler's MAX_BODY_BYTES) next to the other
+corpus pages and its response headers, minus the per-connection ones,
+in pages.json. Re-recording a name replaces its entry.
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+import aiohttp
+
+from scanner.crawler import HEADERS, MAX_BODY_BYTES
+from bench.server import CORPUS_DIR
+
+# per-response headers that would be wrong, or meaningless, when replayed
+DROPPED_HEADERS = {"content-length", "content-encoding", "transfer-encoding", "connection", "keep-alive",
+                   "date", "set-cookie", "age", "expires"}
+
+
+async def record(domain, name, weight=1):
+    url = domain if domain.startswith("http") else f"https://{domain}"
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url, headers=HEADERS, timeout=15) as resp:
+            resp.raise_for_status()
+            body = await resp.content.read(MAX_BODY_BYTES)
+            charset = resp.charset or "utf-8"
+            headers = {k: v for k, v in resp.headers.items() if k.lower() not in DROPPED_HEADERS}
+
+    ext = ".html" if resp.content_type in ("text/html", "application/xhtml+xml") else ".txt"
+    filename = name + ext
+    # corpus files are UTF-8; load_corpus() re-encodes them in the page's own charset
+    with open(os.path.join(CORPUS_DIR, filename), "w", encoding="utf-8") as f:
+        f.write(body.decode(charset, errors="replace"))
+
+    manifest_path = os.path.join(CORPUS_DIR, "pages.json")
+    with open(manifest_path) as f:
+        manifest = [entry for entry in json.load(f) if entry["name"] != name]
+    manifest.append({"name": name, "file": filename, "weight": weight, "headers": headers})
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+    print(f"💾 Recorded {url} as {filename} ({len(body)} bytes)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.record", description="Add a live page to the benchmark corpus.")
+    parser.add_argument("domain")
+    parser.add_argument("name", nargs="?")
+    parser.add_argument("--weight", type=int, default=1, help="how often the replay server hands this page out")
+    opts = parser.parse_args(argv)
+    name = opts.name or opts.domain.split("//")[-1].strip("/").replace("/", "-")
+    asyncio.run(record(opts.domain, name, opts.weight))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+# bench/run.py
+"""Offline throughput benchmarks for detection, crawling and persistence.
+
+    python -m bench.run                       # all suites, compared against bench/baseline.json
+    python -m bench.run detect crawl          # just these suites
+    python -m bench.run --update-baseline     # store this run as the new baseline
+
+The crawl suite replays bench/corpus through a local ReplayServer, so no
+network is needed. The persist suite writes to BENCH_DATABASE_URL and is
+skipped without it; point it at a throwaway database, never a real one.
+Each suite runs in its own process so peak RSS is measured per suite.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import multiprocessing
+from concurrent.futures import wait
+
+from bench.server import load_corpus, LoopbackResolver, ReplayServer, BENCH_SUFFIX
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL")
+BENCH_DOMAINS = int(os.getenv("BENCH_DOMAINS", "500"))
+BENCH_DETECT_ROUNDS = int(os.getenv("BENCH_DETECT_ROUNDS", "20"))
+BENCH_PERSIST_SCANS = int(os.getenv("BENCH_PERSIST_SCANS", "2000"))
+BENCH_TOLERANCE = float(os.getenv("BENCH_TOLERANCE", "0.25"))
+
+SUITES = ("detect", "crawl", "persist")
+# metrics checked against the baseline; *_per_sec must not drop, the rest must not grow
+COMPARED = ("pages_per_sec", "domains_per_sec", "scans_per_sec", "p50_ms", "p99_ms", "peak_rss_mb", "db_round_trips")
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _latency_ms(seconds):
+    return {"p50_ms": round(_percentile(seconds, 0.50) * 1000, 3), "p99_ms": round(_percentile(seconds, 0.99) * 1000, 3)}
+
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF):
+    peak = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def bench_detect(opts):
+    """detect() over every corpus page, as much of each as the crawler would download."""
+    from scanner.crawler import MAX_BODY_BYTES
+    from scanner.detector import detect
+
+    pages = [(p.body[:MAX_BODY_BYTES].decode(p.headers.get("Content-Type", "").partition("charset=")[2] or "utf-8", errors="ignore"), p.headers)
+             for p in load_corpus()]
+    detect(*pages[0])  # warm up
+    seconds = []
+    started = time.perf_counter()
+    for _ in range(opts.rounds):
+        for html, headers in pages:
+            t = time.perf_counter()
+            detect(html, headers)
+            seconds.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+    size = sum(len(html) for html, _ in pages) * opts.rounds
+    return {
+        "pages": len(seconds),
+        "pages_per_sec": round(len(seconds) / elapsed, 1),
+        "mb_per_sec": round(size / elapsed / 1e6, 1),
+        **_latency_ms(seconds),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+async def bench_crawl(opts):
+    """run_scan() with streaming detection against the replay server."""
+    from scanner.crawler import run_scan
+    from scanner.executor import get_executor
+
+    server = ReplayServer(load_corpus(), latency=opts.latency / 1000, jitter=opts.jitter,
+                          error_rate=opts.error_rate, redirect_rate=opts.redirect_rate, seed=opts.seed)
+    await server.start()
+    executor = get_executor()
+    try:
+        await executor.analyze(b"<html><title>warm</title></html>")  # start the worker processes
+        urls = server.urls(opts.domains)
+        started = time.perf_counter()
+        results = await run_scan(urls, executor=executor, resolver=LoopbackResolver())
+        elapsed = time.perf_counter() - started
+    finally:
+        executor.close(wait=True)
+        await server.close()
+
+    # request latency as the crawler saw it: connect + first byte + streamed download and detection
+    seconds = [r["timings"].get("ttfb", 0) + r["timings"].get("download", 0) for r in results if r.get("timings")]
+    return {
+        "domains": len(results),
+        "ok": sum(1 for r in results if r["ok"]),
+        "errors": sum(1 for r in results if not r["ok"]),
+        "requests": server.requests,
+        "mb": round(sum(r.get("bytes", 0) for r in results) / 1e6, 1),
+        "domains_per_sec": round(len(results) / elapsed, 1),
+        **_latency_ms(seconds),
+        "peak_rss_mb": _peak_rss_mb(),
+        "workers_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def bench_persist(opts):
+    """ScanWriter saving a first scan and then an unchanged re-scan of every domain, one batch at a time."""
+    # scanner.db reads DATABASE_URL on import
+    os.environ["DATABASE_URL"] = opts.database_url
+    from scanner.db import ScanWriter, pooled_conn, WRITE_BATCH_SIZE
+    from scanner.detector import detect
+    from scanner.metrics import DB_STATEMENTS, STAGE_SECONDS
+
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM websites WHERE domain LIKE %s", (f"%{BENCH_SUFFIX}",))
+    pages = load_corpus()
+    detected = [detect(p.body[:200_000].decode("utf-8", errors="ignore"), p.headers) for p in pages]
+
+    def first_scan(writer, i):
+        d = detected[i % len(detected)]
+        domain = f"persist-{i:06d}{BENCH_SUFFIX}"
+        return writer.submit(
+            domain, f"https://{domain}", "ok", 200, pages[i % len(pages)].name,
+            d["cms"], d["js_libs"], d["analytics"], d["custom_tags"], d,
+            company="Bench Ltd", validators={"content_hash": f"{i:064x}"}, timings={"total": 0.1},
+        )
+
+    def rescan(writer, i):
+        domain = f"persist-{i:06d}{BENCH_SUFFIX}"
+        return writer.submit(domain, f"https://{domain}", "ok", 304, None, unchanged=True)
+
+    seconds, futures = [], []
+    # flushed by hand every batch, as the pipeline does, so batch sizes don't depend on thread timing
+    with ScanWriter(flush_interval=3600) as writer:
+        started = time.perf_counter()
+        for submit in (first_scan, rescan):
+            for start in range(0, opts.scans, WRITE_BATCH_SIZE):
+                batch_started = time.perf_counter()
+                batch = [submit(writer, i) for i in range(start, min(start + WRITE_BATCH_SIZE, opts.scans))]
+                writer.flush()
+                wait(batch)
+                seconds.append(time.perf_counter() - batch_started)
+                futures.extend(batch)
+        elapsed = time.perf_counter() - started
+
+    flushes = STAGE_SECONDS.count(stage="db_flush")
+    statements = DB_STATEMENTS.value()
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM websites WHERE domain LIKE %s", (f"%{BENCH_SUFFIX}",))
+    return {
+        "scans": len(futures),
+        "failed": sum(1 for f in futures if f.exception()),
+        "flushes": flushes,
+        "scans_per_sec": round(len(futures) / elapsed, 1),
+        # per batch, from the first submit to every future resolved
+        **_latency_ms(seconds),
+        # every flush is one transaction: BEGIN, its statements, COMMIT
+        "db_round_trips": statements + 2 * flushes,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _run_suite(name, opts, results):
+    try:
+        if name == "detect":
+            res = bench_detect(opts)
+        elif name == "crawl":
+            res = asyncio.run(bench_crawl(opts))
+        else:
+            res = bench_persist(opts)
+    except Exception as e:
+        res = {"error": f"{type(e).__name__}: {e}"}
+    results.put(res)
+
+
+def run_isolated(name, opts):
+    """Run one suite in a fresh interpreter so its peak RSS is its own."""
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    proc = ctx.Process(target=_run_suite, args=(name, opts, results))
+    proc.start()
+    res = results.get()
+    proc.join()
+    return res
+
+
+def compare(results, baseline, tolerance):
+    """Lines describing each compared metric, and whether any regressed beyond `tolerance`."""
+    lines, regressed = [], False
+    for suite, metrics in results.items():
+        base = baseline.get(suite, {})
+        for key in COMPARED:
+            if key not in metrics or key not in base or not base[key]:
+                continue
+            change = (metrics[key] - base[key]) / base[key]
+            worse = -change if key.endswith("_per_sec") else change
+            flag = "❌" if worse > tolerance else "✅"
+            regressed |= worse > tolerance
+            lines.append(f"{flag} {suite}.{key}: {metrics[key]} (baseline {base[key]}, {change:+.0%})")
+    return lines, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.run", description="Offline scanner benchmarks.")
+    parser.add_argument("suites", nargs="*", metavar="suite", help=f"any of {', '.join(SUITES)} (default: all)")
+    parser.add_argument("--domains", type=int, default=BENCH_DOMAINS, help="sites to crawl")
+    parser.add_argument("--rounds", type=int, default=BENCH_DETECT_ROUNDS, help="passes over the corpus for detect")
+    parser.add_argument("--scans", type=int, default=BENCH_PERSIST_SCANS, help="scans to save for persist")
+    parser.add_argument("--latency", type=float, default=50, help="mean server latency in ms")
+    parser.add_argument("--jitter", type=float, default=0.5, help="latency spread as a fraction of the mean")
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--redirect-rate", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database-url", default=BENCH_DATABASE_URL)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--tolerance", type=float, default=BENCH_TOLERANCE, help="allowed regression, as a fraction")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--json", help="also write the results to this file")
+    opts = parser.parse_args(argv)
+    unknown = set(opts.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suite: {', '.join(sorted(unknown))}")
+    opts.suites = opts.suites or list(SUITES)
+
+    results = {}
+    for name in opts.suites:
+        if name == "persist" and not opts.database_url:
+            print("⏭  persist: skipped, set BENCH_DATABASE_URL to a throwaway database to run it")
+            continue
+        print(f"⏱  {name} ...", flush=True)
+        res = run_isolated(name, opts)
+        if "error" in res:
+            print(f"❌ {name} failed: {res['error']}")
+            return 1
+        results[name] = res
+        print("   " + "  ".join(f"{k}={v}" for k, v in res.items()))
+
+    if opts.json:
+        with open(opts.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if opts.update_baseline:
+        baseline = {}
+        if os.path.exists(opts.baseline):
+            with open(opts.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(opts.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+        print(f"💾 Baseline saved to {opts.baseline}")
+        return 0
+
+    if not os.path.exists(opts.baseline):
+        print("No baseline yet; run with --update-baseline to store one.")
+        return 0
+    with open(opts.baseline) as f:
+        lines, regressed = compare(results, json.load(f), opts.tolerance)
+    print("\n".join(lines))
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+# bench/server.py
+"""Recorded corpus and a local aiohttp server replaying it, so benchmarks never touch the network."""
+import os
+import json
+import random
+import socket
+import asyncio
+from aiohttp import web
+from aiohttp.abc import AbstractResolver
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+BENCH_SUFFIX = ".bench"
+PAD_MARKER = "<!-- bench:pad -->"
+ERROR_KINDS = ("http_500", "http_404", "reset")
+
+
+class Page:
+    __slots__ = ("name", "body", "headers", "weight")
+
+    def __init__(self, name, body, headers, weight=1):
+        self.name = name
+        self.body = body
+        self.headers = headers
+        self.weight = weight
+
+
+def load_corpus(path=CORPUS_DIR):
+    """Pages listed in pages.json, padded out to their recorded size and encoded in their declared charset."""
+    with open(os.path.join(path, "pages.json")) as f:
+        manifest = json.load(f)
+    pages = []
+    for entry in manifest:
+        with open(os.path.join(path, entry["file"]), encoding="utf-8") as f:
+            text = f.read()
+        if entry.get("pad_to"):
+            # repeat the page's own filler markup until it reaches the size it was recorded at
+            pad = entry["pad"]
+            missing = max(0, entry["pad_to"] - len(text))
+            text = text.replace(PAD_MARKER, pad * (missing // len(pad) + 1), 1)
+        content_type = entry["headers"].get("Content-Type", "")
+        charset = content_type.partition("charset=")[2].strip() or "utf-8"
+        pages.append(Page(entry["name"], text.encode(charset, errors="xmlcharrefreplace"), entry["headers"], entry.get("weight", 1)))
+    return pages
+
+
+class LoopbackResolver(AbstractResolver):
+    """Resolves every *.bench host to 127.0.0.1, so each replayed site is its own host to the crawler."""
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        if not host.endswith(BENCH_SUFFIX):
+            raise OSError(f"{host} is not a benchmark host")
+        return [{"hostname": host, "host": "127.0.0.1", "port": port,
+                 "family": socket.AF_INET, "proto": 0, "flags": socket.AI_NUMERICHOST}]
+
+    async def close(self):
+        pass
+
+
+class ReplayServer:
+    """Serves the corpus on 127.0.0.1 with per-site latency, errors and redirects.
+
+    Every site-N.bench host is assigned a page and a behaviour from a RNG
+    seeded with `seed` and the host name, so a run is reproducible: the
+    same hosts get the same pages, delays, failures and redirects.
+    """
+
+    def __init__(self, pages, latency=0.05, jitter=0.5, error_rate=0.05, redirect_rate=0.1, seed=0):
+        self.pages = pages
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.redirect_rate = redirect_rate
+        self.seed = seed
+        self.port = None
+        self.requests = 0
+        self._runner = None
+
+    def site(self, host):
+        rng = random.Random(f"{self.seed}:{host}")
+        page = rng.choices(self.pages, weights=[p.weight for p in self.pages])[0]
+        delay = self.latency * (1 + rng.uniform(-self.jitter, self.jitter))
+        error = rng.choice(ERROR_KINDS) if rng.random() < self.error_rate else None
+        redirect = rng.random() < self.redirect_rate
+        return page, delay, error, redirect
+
+    def urls(self, count):
+        return [f"http://site-{i:06d}{BENCH_SUFFIX}:{self.port}/" for i in range(count)]
+
+    async def _handle(self, request):
+        self.requests += 1
+        page, delay, error, redirect = self.site(request.host.partition(":")[0])
+        await asyncio.sleep(delay)
+        if redirect and request.path == "/":
+            raise web.HTTPMovedPermanently("/home")
+        if error == "reset":
+            request.transport.close()
+            return web.Response()
+        if error:
+            return web.Response(status=int(error.rpartition("_")[2]), text="error")
+        return web.Response(body=page.body, headers=page.headers)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/{tail:.*}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def close(self):
+        if self._runner:
+            await self._runner.cleanup()
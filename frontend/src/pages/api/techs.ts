@@ -13,34 +13,38 @@ export default async function handler(
   try {
     const client = await pool.connect();
 
+    // counts are kept up to date by the scanner, no GROUP BY needed
     const agg = await client.query(`
-      SELECT t.name, COALESCE(t.category, 'Other') as category, count(*) as cnt
-      FROM website_technologies wt
-      JOIN technologies t ON t.id = wt.technology_id
-      GROUP BY t.name, t.category
-      ORDER BY cnt DESC
+      SELECT name, COALESCE(category, 'Other') as category, website_count as cnt
+      FROM technologies
+      WHERE website_count > 0
+      ORDER BY website_count DESC, name
       LIMIT 200
     `);
 
+    const namesRes = await client.query(`SELECT id, name FROM technologies`);
+
+    // tech_bits: character N is '1' when the site uses technology id N
     const domainsRes = await client.query(`
-      SELECT w.domain, w.company_name, w.hosting, array_remove(array_agg(t.name), NULL) as techs
-      FROM websites w
-      LEFT JOIN website_technologies wt ON wt.website_id = w.id
-      LEFT JOIN technologies t ON t.id = wt.technology_id
-      GROUP BY w.id, w.domain, w.company_name, w.hosting
-      ORDER BY w.domain
+      SELECT domain, company_name, hosting, tech_bits::text as tech_bits
+      FROM websites
+      ORDER BY domain
       LIMIT 2000
     `);
 
     client.release();
 
+    const names = new Map<number, string>(namesRes.rows.map((t: any) => [t.id, t.name] as [number, string]));
+    const decode = (bits: string) =>
+      Array.from(bits || "").flatMap((bit, id) => (bit === "1" && names.has(id) ? [names.get(id)!] : []));
+
     res.status(200).json({
       techs: agg.rows,
       domains: domainsRes.rows.map((d: any) => ({
         domain: d.domain,
         company: d.company_name,
         hosting: d.hosting,
-        techs: d.techs,
+        techs: decode(d.tech_bits),
       })),
     });
   } catch (err) {
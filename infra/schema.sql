@@ -5,20 +5,51 @@ CREATE TABLE IF NOT EXISTS websites (
     id SERIAL PRIMARY KEY,
     domain TEXT UNIQUE NOT NULL,       -- normalized domain (e.g., example.com)
     url TEXT,                          -- last resolved URL (with redirects)
-    company_name TEXT,                 -- WHOIS org / registrant name
+    company_name TEXT,                 -- WHOIS org / registrant name ('-' when none was found)
+    company_checked_at TIMESTAMP WITH TIME ZONE,  -- when company_name was last looked up
     hosting TEXT,                      -- infra provider (Cloudflare, AWS, etc.)
+    status TEXT,                       -- 'ok' / 'error' from the last scan
+    http_status INT,                   -- HTTP status of the last scan
+    title TEXT,                        -- <title> of the last scanned page
+    etag TEXT,                         -- validators sent back on the next scan
+    last_modified TEXT,
+    content_hash TEXT,                 -- sha256 of the body read on the last successful scan
+    scan_count INT NOT NULL DEFAULT 0,
+    change_count INT NOT NULL DEFAULT 0,  -- scans whose content_hash differed from the one before
+    last_changed TIMESTAMP WITH TIME ZONE,
+    tech_bits VARBIT NOT NULL DEFAULT B'',  -- bit N set = technology id N detected (same set as website_technologies)
+    last_timings JSONB,                -- per-stage seconds of the latest scan (detections.timings only has scans that changed something)
     last_scanned TIMESTAMP WITH TIME ZONE DEFAULT now()
 );
 
+-- columns added since the first release; tech_bits is added (and backfilled) further down
+ALTER TABLE websites
+    ADD COLUMN IF NOT EXISTS company_checked_at TIMESTAMP WITH TIME ZONE,
+    ADD COLUMN IF NOT EXISTS status TEXT,
+    ADD COLUMN IF NOT EXISTS http_status INT,
+    ADD COLUMN IF NOT EXISTS title TEXT,
+    ADD COLUMN IF NOT EXISTS etag TEXT,
+    ADD COLUMN IF NOT EXISTS last_modified TEXT,
+    ADD COLUMN IF NOT EXISTS content_hash TEXT,
+    ADD COLUMN IF NOT EXISTS scan_count INT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS change_count INT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS last_changed TIMESTAMP WITH TIME ZONE,
+    ADD COLUMN IF NOT EXISTS last_timings JSONB;
+
 -- ================================
 -- Technologies table
 -- ================================
 CREATE TABLE IF NOT EXISTS technologies (
     id SERIAL PRIMARY KEY,
     name TEXT UNIQUE NOT NULL,         -- e.g., "React", "WordPress"
-    category TEXT                      -- e.g., CMS, Framework, Analytics
+    category TEXT,                     -- e.g., CMS, Framework, Analytics
+    pattern TEXT,                      -- optional detection regex (case-insensitive), see scanner/detector.py
+    website_count INT NOT NULL DEFAULT 0  -- rows in website_technologies (scanner writer + websites_uncount trigger)
 );
 
+-- website_count is added (and backfilled) further down
+ALTER TABLE technologies ADD COLUMN IF NOT EXISTS pattern TEXT;
+
 -- ================================
 -- Scan queue
 -- ================================
@@ -26,9 +57,33 @@ CREATE TABLE IF NOT EXISTS scan_queue (
     id SERIAL PRIMARY KEY,
     domain TEXT NOT NULL,
     processed BOOLEAN DEFAULT false,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    claimed_by TEXT,                   -- scanner worker holding the lease
+    claimed_at TIMESTAMP WITH TIME ZONE,  -- lease start; expired leases are reclaimed
+    attempts INT NOT NULL DEFAULT 0,   -- claims so far; the worker gives up after QUEUE_MAX_ATTEMPTS
+    processed_at TIMESTAMP WITH TIME ZONE
 );
 
+ALTER TABLE scan_queue
+    ADD COLUMN IF NOT EXISTS claimed_by TEXT,
+    ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP WITH TIME ZONE,
+    ADD COLUMN IF NOT EXISTS attempts INT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS processed_at TIMESTAMP WITH TIME ZONE;
+
+CREATE INDEX IF NOT EXISTS scan_queue_pending_idx ON scan_queue (id) WHERE processed = false;
+
+-- wake scanner workers (LISTEN scan_queue) as soon as something is queued
+CREATE OR REPLACE FUNCTION notify_scan_queue() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('scan_queue', NEW.id::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS scan_queue_notify ON scan_queue;
+CREATE TRIGGER scan_queue_notify AFTER INSERT ON scan_queue
+    FOR EACH ROW EXECUTE FUNCTION notify_scan_queue();
+
 -- ================================
 -- Mapping: Website ↔ Technologies
 -- ================================
@@ -39,8 +94,79 @@ CREATE TABLE IF NOT EXISTS website_technologies (
     PRIMARY KEY (website_id, technology_id)
 );
 
+-- websites using a technology, in id order (tech filters with keyset pagination)
+CREATE INDEX IF NOT EXISTS website_technologies_tech_idx ON website_technologies (technology_id, website_id);
+
+-- tech_bits and website_count summarise website_technologies; on a database that
+-- predates them, fill them in from the rows already there
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_schema = current_schema() AND table_name = 'websites' AND column_name = 'tech_bits') THEN
+        ALTER TABLE websites ADD COLUMN tech_bits VARBIT NOT NULL DEFAULT B'';
+        UPDATE websites w SET tech_bits = (
+            SELECT string_agg(CASE WHEN i = ANY(t.ids) THEN '1' ELSE '0' END, '' ORDER BY i)::varbit
+            FROM generate_series(0, t.max_id) AS i
+        )
+        FROM (
+            SELECT website_id, array_agg(technology_id) AS ids, max(technology_id) AS max_id
+            FROM website_technologies GROUP BY website_id
+        ) t
+        WHERE w.id = t.website_id;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_schema = current_schema() AND table_name = 'technologies' AND column_name = 'website_count') THEN
+        ALTER TABLE technologies ADD COLUMN website_count INT NOT NULL DEFAULT 0;
+        UPDATE technologies t SET website_count = c.n
+        FROM (SELECT technology_id, count(*) AS n FROM website_technologies GROUP BY technology_id) c
+        WHERE t.id = c.technology_id;
+    END IF;
+END $$;
+
+-- the scanner's writer moves technologies.website_count as it changes website_technologies;
+-- deleting websites (which cascades into website_technologies) has to take their counts back out
+CREATE OR REPLACE FUNCTION uncount_deleted_websites() RETURNS trigger AS $$
+BEGIN
+    WITH removed AS (
+        SELECT i - 1 AS technology_id, count(*) AS n
+        FROM deleted_websites w, generate_series(1, length(w.tech_bits)) AS i
+        WHERE substring(w.tech_bits FROM i FOR 1) = B'1'
+        GROUP BY 1
+    ),
+    -- same lock order as the writer
+    locked AS (
+        SELECT t.id FROM technologies t JOIN removed ON removed.technology_id = t.id
+        ORDER BY t.id
+        FOR UPDATE OF t
+    )
+    UPDATE technologies t SET website_count = t.website_count - removed.n
+    FROM locked JOIN removed ON removed.technology_id = locked.id
+    WHERE t.id = locked.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS websites_uncount ON websites;
+CREATE TRIGGER websites_uncount AFTER DELETE ON websites
+    REFERENCING OLD TABLE AS deleted_websites
+    FOR EACH STATEMENT EXECUTE FUNCTION uncount_deleted_websites();
+
+CREATE OR REPLACE FUNCTION reset_website_counts() RETURNS trigger AS $$
+BEGIN
+    UPDATE technologies SET website_count = 0 WHERE website_count <> 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS websites_reset_counts ON websites;
+CREATE TRIGGER websites_reset_counts AFTER TRUNCATE ON websites
+    FOR EACH STATEMENT EXECUTE FUNCTION reset_website_counts();
+
 -- ================================
 -- Detections table (for db.py compatibility)
+-- A row is only added when a scan's outcome differs from the last one
+-- (status, or the set of technologies detected).
 -- ================================
 CREATE TABLE IF NOT EXISTS detections (
     id SERIAL PRIMARY KEY,
@@ -50,9 +176,15 @@ CREATE TABLE IF NOT EXISTS detections (
     js_libs TEXT[] DEFAULT '{}',
     analytics TEXT[] DEFAULT '{}',
     custom_tags TEXT[] DEFAULT '{}',
-    raw JSONB DEFAULT '{}'::jsonb
+    raw JSONB DEFAULT '{}'::jsonb,
+    timings JSONB                      -- per-stage seconds of this scan (dns, connect, ttfb, download, detect, whois, total)
 );
 
+ALTER TABLE detections ADD COLUMN IF NOT EXISTS timings JSONB;
+
+-- latest detection per website (API result cache fallback)
+CREATE INDEX IF NOT EXISTS detections_website_latest_idx ON detections (website_id, detected_at DESC);
+
 -- ================================
 -- Seed common technologies
 -- ================================
@@ -1,77 +1,224 @@
 # scanner/crawler.py
+import os
+import codecs
+import hashlib
+import time
 import asyncio
+from concurrent.futures import BrokenExecutor
 import aiohttp
-from bs4 import BeautifulSoup
+from multidict import CIMultiDict
+from yarl import URL
 
-from scanner.detector import detect_technologies, get_company
-from scanner.db import get_conn, upsert_website, insert_detection
+from scanner.throttle import HostThrottle, GLOBAL_CONCURRENCY, OVERLOADED
+from scanner.metrics import STAGE_SECONDS, BYTES, DOMAINS, ERRORS
 
 HEADERS = {"User-Agent": "Mozilla/5.0 (compatible; MiniMixRankBot/1.0)"}
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", str(2 * 1024 * 1024)))
+CHUNK_BYTES = int(os.getenv("CHUNK_BYTES", str(64 * 1024)))
+HTML_TYPES = {"text/html", "application/xhtml+xml"}
+FETCH_RETRIES = int(os.getenv("FETCH_RETRIES", "2"))
+DNS_CACHE_TTL = int(os.getenv("DNS_CACHE_TTL", "300"))
+KEEPALIVE_TIMEOUT = float(os.getenv("KEEPALIVE_TIMEOUT", "30"))
 
 
-async def fetch_html(session, url):
-    """Fetch HTML content for a given URL asynchronously."""
+def _trace_stage(stage):
+    """aiohttp trace callbacks timing one connection stage into STAGE_SECONDS and the request's timings dict."""
+    async def on_start(session, ctx, params):
+        setattr(ctx, stage, time.monotonic())
+
+    async def on_end(session, ctx, params):
+        elapsed = time.monotonic() - getattr(ctx, stage)
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if isinstance(ctx.trace_request_ctx, dict):
+            ctx.trace_request_ctx[stage] = ctx.trace_request_ctx.get(stage, 0.0) + elapsed
+
+    return on_start, on_end
+
+
+def make_trace_config():
+    config = aiohttp.TraceConfig()
+    dns_start, dns_end = _trace_stage("dns")
+    config.on_dns_resolvehost_start.append(dns_start)
+    config.on_dns_resolvehost_end.append(dns_end)
+    # TCP and TLS handshakes together; aiohttp doesn't report them separately
+    connect_start, connect_end = _trace_stage("connect")
+    config.on_connection_create_start.append(connect_start)
+    config.on_connection_create_end.append(connect_end)
+    return config
+
+
+def make_session(**kwargs):
+    """ClientSession on make_connector() with per-stage timing traces."""
+    return aiohttp.ClientSession(connector=make_connector(**kwargs), trace_configs=[make_trace_config()])
+
+
+def make_connector(limit=GLOBAL_CONCURRENCY, limit_per_host=0, resolver=None):
+    """Connector with a long-lived DNS cache and keep-alive, shared by every fetch of a session."""
+    return aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        resolver=resolver,
+    )
+
+
+def _encoding(charset):
     try:
-        async with session.get(url, headers=HEADERS, timeout=15) as resp:
-            text = await resp.text(errors="ignore")
-            return {
+        return codecs.lookup(charset).name if charset else "utf-8"
+    except LookupError:
+        return "utf-8"
+
+
+async def fetch_html(session, url, executor=None, max_bytes=MAX_BODY_BYTES, validators=None, throttle=None):
+    """Fetch HTML content for a given URL asynchronously.
+
+    The body is streamed in CHUNK_BYTES pieces and cut off at `max_bytes`;
+    non-200 and non-HTML responses are not downloaded at all. With an
+    executor, each chunk is handed to its incremental analysis instead of
+    being kept, the download stops as soon as nothing more can be detected,
+    and the result carries "detected" and "title" rather than "body".
+
+    `validators` from the previous scan (etag, last_modified, content_hash)
+    make the request conditional. A 304, or a body hashing the same as
+    before, comes back with "unchanged": True. The hash only counts when the
+    whole body (up to `max_bytes`) was read; if detection stopped the download
+    early, "content_hash" is None and the page is never taken as unchanged.
+
+    With a HostThrottle every attempt holds one of its slots, its outcome
+    feeds the host's adaptive limit, and 429/503 answers are retried up to
+    FETCH_RETRIES times once the host's back-off has passed.
+    """
+    validators = validators or {}
+    request_headers = dict(HEADERS)
+    if validators.get("etag"):
+        request_headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        request_headers["If-Modified-Since"] = validators["last_modified"]
+
+    if throttle is None:
+        return await _fetch_once(session, url, request_headers, executor, max_bytes, validators)
+
+    host = URL(url).host or url
+    for attempt in range(FETCH_RETRIES + 1):
+        await throttle.acquire(host)
+        result = {}
+        try:
+            result = await _fetch_once(session, url, request_headers, executor, max_bytes, validators)
+        finally:
+            headers = result.get("headers") or {}
+            await throttle.release(host, result.get("status"), result.get("ttfb"), headers.get("Retry-After"))
+        if result.get("status") not in OVERLOADED:
+            break
+    result["attempts"] = attempt + 1
+    return result
+
+
+async def _fetch_once(session, url, request_headers, executor, max_bytes, validators):
+    timings = {}
+    started = time.monotonic()
+    try:
+        async with session.get(url, headers=request_headers, timeout=15, trace_request_ctx=timings) as resp:
+            headers = CIMultiDict(resp.headers)
+            timings["ttfb"] = time.monotonic() - started
+            STAGE_SECONDS.observe(timings["ttfb"], stage="ttfb")
+            result = {
                 "ok": resp.status == 200,
                 "status": resp.status,
                 "url": str(resp.url),
-                "text": text,
+                "headers": headers,
+                "ttfb": timings["ttfb"],
+                "timings": timings,
             }
+            if resp.status == 304:
+                # a 304 may carry fresh validators; anything it leaves out is still current
+                result.update(ok=True, unchanged=True, validators={
+                    **validators,
+                    "etag": headers.get("ETag") or validators.get("etag"),
+                    "last_modified": headers.get("Last-Modified") or validators.get("last_modified"),
+                })
+                return result
+            if not result["ok"]:
+                return result
+            # a missing Content-Type is given the benefit of the doubt
+            if "Content-Type" in headers and resp.content_type not in HTML_TYPES:
+                result.update(ok=False, error=f"Skipped non-HTML content ({resp.content_type})", error_type="non_html")
+                return result
+
+            encoding = _encoding(resp.charset)
+            analysis = executor.stream(encoding, headers) if executor else None
+            download_started = time.monotonic()
+            body = bytearray()
+            digest = hashlib.sha256()
+            size = 0
+            complete = True
+            async for chunk in resp.content.iter_chunked(CHUNK_BYTES):
+                chunk = chunk[:max_bytes - size]
+                size += len(chunk)
+                digest.update(chunk)
+                if analysis is None:
+                    body += chunk
+                elif await analysis.feed(chunk):
+                    # the hash only covers what was read, which may not be the whole page
+                    complete = size >= max_bytes or resp.content.at_eof()
+                    break
+                if size >= max_bytes:
+                    result["truncated"] = True
+                    break
+
+            result["bytes"] = size
+            BYTES.inc(size)
+            # with streaming detection this includes waiting on the detector between chunks
+            timings["download"] = time.monotonic() - download_started
+            STAGE_SECONDS.observe(timings["download"], stage="download")
+            content_hash = digest.hexdigest() if complete else None
+            result["validators"] = {
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "content_hash": content_hash,
+            }
+            result["unchanged"] = content_hash is not None and content_hash == validators.get("content_hash")
+            if analysis is None:
+                result.update(body=bytes(body), encoding=encoding)
+            else:
+                analysis = await analysis.finish()
+                timings["detect"] = analysis.pop("seconds")
+                result.update(analysis)
+            return result
+    except BrokenExecutor:
+        # the detection pool failing says nothing about the site; let the caller decide what to do with the scan
+        raise
     except Exception as e:
-        return {"ok": False, "error": str(e), "url": url, "status": None}
+        return {"ok": False, "error": str(e) or type(e).__name__, "error_type": type(e).__name__, "url": url, "status": None, "timings": timings}
 
 
-async def process_domain(session, domain):
-    """Process a single domain: fetch, detect tech, save to DB."""
+async def process_domain(session, domain, executor=None, validators=None, throttle=None):
+    """Fetch a single domain. Saving is left to the caller."""
     url = domain if domain.startswith("http") else f"https://{domain}"
-    result = await fetch_html(session, url)
+    result = await fetch_html(session, url, executor, validators=validators, throttle=throttle)
 
     if result["ok"]:
-        html = result["text"]
-
-        # detect techs from HTML + headers
-        detected = detect_technologies(html, {"url": result["url"]})
-
-        # company from WHOIS
-        company = get_company(domain)
-
-        # save results in DB
-        conn = get_conn()
-        wid = upsert_website(conn, domain, result["url"], "ok", result["status"], None)
-        insert_detection(conn, wid, detected, [], [], [], {"company": company})
-        conn.close()
-
-        return {
-            "domain": domain,
-            "url": result["url"],
-            "ok": True,
-            "status": result["status"],
-            "detected": detected,
-        }
+        DOMAINS.inc(outcome="unchanged" if result.get("unchanged") else "ok")
+        return {"domain": domain, **result}
 
     else:
-        # error case, log to DB as failed detection
-        conn = get_conn()
-        wid = upsert_website(conn, domain, url, "error", result.get("status"), None)
-        insert_detection(conn, wid, [], [], [], [], {"error": result.get("error")})
-        conn.close()
-
+        DOMAINS.inc(outcome="error")
+        ERRORS.inc(error=result.get("error_type") or (f"http_{result['status']}" if result.get("status") else "other"))
         return {
             "domain": domain,
             "url": url,
             "ok": False,
             "status": result.get("status"),
+            "headers": result.get("headers"),
             "error": result.get("error"),
+            "timings": result.get("timings", {}),
         }
 
 
-async def run_scan(domains, concurrency=3):
+async def run_scan(domains, concurrency=3, executor=None, resolver=None):
     """Run parallel scans for a list of domains."""
-    connector = aiohttp.TCPConnector(limit_per_host=concurrency)
-    async with aiohttp.ClientSession(connector=connector) as session:
-        tasks = [process_domain(session, d) for d in domains]
+    throttle = HostThrottle(host_max=concurrency)
+    async with make_session(resolver=resolver) as session:
+        tasks = [process_domain(session, d, executor, throttle=throttle) for d in domains]
         results = await asyncio.gather(*tasks)
     return results
@@ -1,7 +1,21 @@
 # scanner/detector.py
 import re
+import time
 import whois
 
+try:
+    from whois.exceptions import UnknownTldError, WhoisDomainNotFoundError
+    # WHOIS answered, there is just no record to take an org from
+    WHOIS_NO_RECORD = (UnknownTldError, WhoisDomainNotFoundError)
+except ImportError:  # older python-whois raises its base error for unknown domains
+    from whois.parser import PywhoisError
+    WHOIS_NO_RECORD = (PywhoisError,)
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
 TECH_PATTERNS = {
     "WordPress": re.compile(r"wp-content|wordpress", re.I),
     "Drupal": re.compile(r"drupal", re.I),
@@ -29,20 +43,242 @@ TECH_PATTERNS = {
 }
 
 
+# output bucket for each technology (same grouping detect() has always returned)
+TECH_CATEGORIES = {
+    "WordPress": "cms",
+    "Drupal": "cms",
+    "Joomla": "cms",
+    "Shopify": "cms",
+    "React": "js_libs",
+    "Vue.js": "js_libs",
+    "Angular": "js_libs",
+    "Next.js": "js_libs",
+    "Svelte": "js_libs",
+    "Ember.js": "js_libs",
+    "jQuery": "js_libs",
+    "Google Analytics": "analytics",
+    "Stripe": "custom_tags",
+    "PayPal": "custom_tags",
+    "Cloudflare": "custom_tags",
+    "Akamai": "custom_tags",
+    "Fastly": "custom_tags",
+}
+
+# technologies.category (infra/schema.sql) -> detect() bucket, for rules loaded from the DB
+SCHEMA_CATEGORIES = {
+    "CMS": "cms",
+    "Ecommerce": "cms",
+    "Framework": "js_libs",
+    "Library": "js_libs",
+    "Analytics": "analytics",
+    "Payment": "custom_tags",
+    "Security": "custom_tags",
+    "CDN": "custom_tags",
+}
+
+CATEGORY_KEYS = ("cms", "js_libs", "analytics", "custom_tags")
+
+# characters re.I folds onto ASCII letters that str.lower() leaves alone (or expands)
+_FOLD = str.maketrans({"İ": "i", "ı": "i", "ſ": "s", "K": "k"})
+_FOLD_CHARS = re.compile("[" + "".join(chr(c) for c in _FOLD) + "]")
+_MAX_ALTERNATIVES = 64
+_OPTIONAL = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+
+
+def _fold(text: str) -> str:
+    # translate() is slow on long non-ASCII text; skip it unless one of those characters is there
+    if not text.isascii() and _FOLD_CHARS.search(text):
+        text = text.translate(_FOLD)
+    return text.lower()
+
+
+def _expand(seq) -> list[tuple[str, bool]] | None:
+    """(leading literal, literal alone proves a match) for each way through a parsed regex."""
+    prefix = ""
+    for pos, (op, av) in enumerate(seq):
+        if op is sre_parse.LITERAL:
+            prefix += chr(av)
+            continue
+        tail = list(seq[pos + 1:])
+        if op is sre_parse.BRANCH:
+            out = []
+            for branch in av[1]:
+                sub = _expand(list(branch) + tail)
+                if sub is None:
+                    return None
+                out.extend((prefix + lit, exact) for lit, exact in sub)
+            return out if len(out) <= _MAX_ALTERNATIVES else None
+        nullable = all(o in _OPTIONAL and a[0] == 0 for o, a in [(op, av)] + tail)
+        return [(prefix, nullable)]
+    return [(prefix, True)]
+
+
+def _literals(pattern: re.Pattern) -> tuple[list[str], bool] | None:
+    """Lowercase literals one of which must appear for `pattern` to match, or None."""
+    try:
+        alternatives = _expand(list(sre_parse.parse(pattern.pattern, pattern.flags)))
+    except Exception:
+        return None
+    if not alternatives or any(not lit or not lit.isascii() for lit, _ in alternatives):
+        return None
+    exact = bool(pattern.flags & re.I) and all(e for _, e in alternatives)
+    return [lit.lower() for lit, _ in alternatives], exact
+
+
+def _trie_regex(words) -> str:
+    """Alternation with shared prefixes factored out, so matching branches once per character."""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def emit(node):
+        alts = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return emit(trie)
+
+
+class DetectionEngine:
+    """Rules compiled into a single literal prefilter.
+
+    Every rule's required leading literals go into one trie-shaped regex that
+    is run once over the case-folded page. Rules that are nothing but those
+    literals are decided by the prefilter alone; the rest only run their full
+    regex when one of their literals showed up. Rules without a usable literal
+    are always run in full.
+    """
+
+    def __init__(self, patterns: dict, categories: dict | None = None):
+        self.names = list(patterns)
+        self.patterns = [patterns[n] for n in self.names]
+        self.categories = dict(TECH_CATEGORIES if categories is None else categories)
+        self.exact = set()
+        self.unfiltered = set()
+
+        owners = {}
+        for i, pattern in enumerate(self.patterns):
+            info = _literals(pattern)
+            if info is None:
+                self.unfiltered.add(i)
+                continue
+            literals, exact = info
+            if exact:
+                self.exact.add(i)
+            for lit in literals:
+                owners.setdefault(lit, set()).add(i)
+        self.filtered = frozenset(i for s in owners.values() for i in s)
+
+        # the prefilter reports the longest literal at an offset, which also proves its prefixes
+        self.owners = {}
+        for lit in owners:
+            rules = set()
+            for k in range(1, len(lit) + 1):
+                rules |= owners.get(lit[:k], set())
+            self.owners[lit] = frozenset(rules)
+        self.prefilter = re.compile(_trie_regex(owners)) if owners else None
+
+    def _candidates(self, folded: str, wanted) -> set:
+        pending = set(wanted) & self.filtered
+        hits = set()
+        pos = 0
+        while pending:
+            m = self.prefilter.search(folded, pos)
+            if not m:
+                break
+            rules = self.owners[m.group()]
+            hits |= rules
+            pending -= rules
+            pos = m.start() + 1
+        return hits
+
+    def _search(self, i, texts, timings):
+        if timings is None:
+            return any(self.patterns[i].search(t) for t in texts)
+        started = time.perf_counter()
+        try:
+            return any(self.patterns[i].search(t) for t in texts)
+        finally:
+            timings[i] = timings.get(i, 0.0) + time.perf_counter() - started
+
+    def find_indices(self, html: str, headers: dict | None = None, remaining=None, timings=None) -> set:
+        """Indexes of the rules in `remaining` (default: all) matching the body or any header value.
+
+        If `timings` is a dict, seconds spent running each rule's full regex
+        are added to it under the rule's index.
+        """
+        wanted = set(range(len(self.patterns)) if remaining is None else remaining)
+        found = set()
+        for i in (self._candidates(_fold(html), wanted) | self.unfiltered) & wanted:
+            if i in self.exact or self._search(i, (html,), timings):
+                found.add(i)
+
+        wanted -= found
+        if headers and wanted:
+            values = [str(v) for v in headers.values()]
+            # joined values may match across two headers, so confirm per value
+            candidates = self._candidates(_fold("\n".join(values)), wanted)
+            for i in (candidates | self.unfiltered) & wanted:
+                if self._search(i, values, timings):
+                    found.add(i)
+
+        return found
+
+    def find(self, html: str, headers: dict | None = None) -> list[str]:
+        """Names of every rule matching the body or any header value, in rule order."""
+        return [self.names[i] for i in sorted(self.find_indices(html, headers))]
+
+    def group(self, found) -> dict:
+        """detect()-shaped result for a set of matched rule indexes."""
+        names = [self.names[i] for i in sorted(found)]
+        result = {key: [] for key in CATEGORY_KEYS}
+        for name in names:
+            key = self.categories.get(name)
+            if key:
+                result[key].append(name)
+        result["raw"] = names
+        return result
+
+    def detect(self, html: str, headers: dict | None = None) -> dict:
+        return self.group(self.find_indices(html, headers))
+
+
+ENGINE = DetectionEngine(TECH_PATTERNS)
+
+
+def load_engine(conn) -> DetectionEngine:
+    """Extend the built-in rules with `technologies.pattern` rows and make them the default."""
+    global ENGINE
+    patterns = dict(TECH_PATTERNS)
+    categories = dict(TECH_CATEGORIES)
+    with conn.cursor() as cur:
+        cur.execute("SELECT name, category, pattern FROM technologies WHERE pattern IS NOT NULL ORDER BY id")
+        for name, category, pattern in cur.fetchall():
+            try:
+                patterns[name] = re.compile(pattern, re.I)
+            except re.error as e:
+                # one bad row shouldn't throw away every other rule
+                print(f"[!] Skipping detection rule {name!r}: {e}")
+                continue
+            if name not in TECH_CATEGORIES and SCHEMA_CATEGORIES.get(category):
+                categories[name] = SCHEMA_CATEGORIES[category]
+    ENGINE = DetectionEngine(patterns, categories)
+    return ENGINE
+
+
 def detect(html: str, headers: dict | None = None) -> dict:
     """Return structured detection result."""
-    found = []
-    for name, pattern in TECH_PATTERNS.items():
-        if pattern.search(html) or (headers and any(pattern.search(str(v)) for v in headers.values())):
-            found.append(name)
+    return ENGINE.detect(html, headers)
+
 
-    return {
-        "cms": [t for t in found if t in ["WordPress", "Drupal", "Joomla", "Shopify"]],
-        "js_libs": [t for t in found if t in ["React", "Vue.js", "Angular", "Next.js", "Svelte", "Ember.js", "jQuery"]],
-        "analytics": [t for t in found if t in ["Google Analytics"]],
-        "custom_tags": [t for t in found if t in ["Stripe", "PayPal", "Cloudflare", "Akamai", "Fastly"]],
-        "raw": found,
-    }
+def get_title(html: str) -> str | None:
+    m = re.search(r"<title>(.*?)</title>", html, re.I | re.S)
+    return m.group(1).strip() if m else None
 
 
 # alias so crawler.py and api/main.py can both use detect_technologies()
@@ -52,16 +288,29 @@ def detect_technologies(html: str, headers: dict | None = None) -> list[str]:
     return result["raw"]
 
 
+def whois_company(domain: str) -> str:
+    """Company/org name from WHOIS, or "-" when the record has none.
+
+    Lookup failures (timeouts, refused connections, rate limits) raise instead,
+    so callers can tell them apart from a real empty answer.
+    """
+    try:
+        w = whois.whois(domain, ignore_socket_errors=False)
+    except WHOIS_NO_RECORD:
+        return "-"
+    for field in ["org", "registrant_org", "registrant_name", "registrant_company", "name"]:
+        val = w.get(field)
+        if isinstance(val, list):
+            val = val[0]
+        if isinstance(val, str) and val.strip() and "REDACTED" not in val.upper():
+            return val.strip()
+    return "-"
+
+
 def get_company(domain: str) -> str:
     """Try WHOIS lookup for company/org name."""
     try:
-        w = whois.whois(domain)
-        for field in ["org", "registrant_org", "registrant_name", "registrant_company", "name"]:
-            val = w.get(field)
-            if isinstance(val, list):
-                val = val[0]
-            if isinstance(val, str) and val.strip() and "REDACTED" not in val.upper():
-                return val.strip()
+        return whois_company(domain)
     except Exception as e:
         print(f"[!] WHOIS error for {domain}: {e}")
     return "-"
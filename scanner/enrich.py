@@ -0,0 +1,146 @@
+# scanner/enrich.py
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import tldextract
+
+from scanner.detector import whois_company
+from scanner.db import pooled_conn
+from scanner.metrics import STAGE_SECONDS, WHOIS_LOOKUPS
+
+WHOIS_WORKERS = int(os.getenv("WHOIS_WORKERS", "4"))
+WHOIS_CACHE_SIZE = int(os.getenv("WHOIS_CACHE_SIZE", "10000"))
+WHOIS_TTL = float(os.getenv("WHOIS_TTL", str(30 * 86400)))
+WHOIS_NEGATIVE_TTL = float(os.getenv("WHOIS_NEGATIVE_TTL", str(86400)))
+
+# what whois_company() returns when WHOIS has no usable org
+NO_COMPANY = "-"
+
+
+def registered_domain(domain: str) -> str:
+    """example.co.uk for www.shop.example.co.uk, so subdomains share one lookup."""
+    e = tldextract.extract(domain)
+    return ".".join(p for p in (e.domain, e.suffix) if p) or domain
+
+
+class CompanyResolver:
+    """WHOIS org lookups off the event loop.
+
+    Answers come from an in-process LRU, then from websites.company_name
+    (when checked recently enough), and only then from WHOIS in a bounded
+    thread pool. Concurrent lookups for the same registered domain share one
+    WHOIS call, and "no org found" is cached too, for WHOIS_NEGATIVE_TTL.
+    A lookup that fails (WHOIS unreachable or rate-limited) returns None and
+    is not cached, so the stored company stays and the next scan asks again.
+    Answers carry the time WHOIS gave them, wherever they were served from, so
+    storing one again doesn't restart its TTL.
+    """
+
+    def __init__(self, workers=WHOIS_WORKERS, maxsize=WHOIS_CACHE_SIZE, ttl=WHOIS_TTL, negative_ttl=WHOIS_NEGATIVE_TTL, use_db=True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.use_db = use_db
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="whois")
+        self._cache = OrderedDict()
+        self._inflight = {}
+
+    def _ttl_for(self, company):
+        return self.negative_ttl if company == NO_COMPANY else self.ttl
+
+    def _cached(self, key):
+        hit = self._cache.get(key)
+        if hit is None:
+            return None
+        company, checked_at = hit
+        if time.time() - checked_at > self._ttl_for(company):
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return hit
+
+    def _remember(self, key, company, checked_at):
+        self._cache[key] = (company, checked_at)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def _from_db(self, key, domain):
+        # exact domains only, so the lookup stays on the websites.domain unique index
+        with pooled_conn() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT company_name, EXTRACT(EPOCH FROM company_checked_at), EXTRACT(EPOCH FROM now() - company_checked_at)
+                FROM websites
+                WHERE domain = ANY(%s) AND company_checked_at IS NOT NULL
+                ORDER BY company_checked_at DESC
+                LIMIT 1
+            """, (list({key, domain}),))
+            row = cur.fetchone()
+        if row is None:
+            return None
+        company, checked_at, age = row[0] or NO_COMPANY, float(row[1]), float(row[2])
+        return (company, checked_at) if age < self._ttl_for(company) else None
+
+    def _resolve(self, key, domain):
+        if self.use_db:
+            started = time.monotonic()
+            try:
+                stored = self._from_db(key, domain)
+                if stored is not None:
+                    WHOIS_LOOKUPS.inc(source="db")
+                    return stored
+            except Exception as e:
+                print(f"[!] company cache lookup failed for {key}: {e}")
+            finally:
+                STAGE_SECONDS.observe(time.monotonic() - started, stage="db_query")
+        started = time.monotonic()
+        try:
+            company = whois_company(key)
+        except Exception as e:
+            print(f"[!] WHOIS error for {key}: {e}")
+            WHOIS_LOOKUPS.inc(source="error")
+            return None, None
+        finally:
+            STAGE_SECONDS.observe(time.monotonic() - started, stage="whois")
+        WHOIS_LOOKUPS.inc(source="whois")
+        return company, time.time()
+
+    async def lookup(self, domain: str) -> tuple[str | None, float | None]:
+        """(company, when WHOIS gave that answer in epoch seconds); (None, None) if WHOIS failed."""
+        key = registered_domain(domain)
+        hit = self._cached(key)
+        if hit is not None:
+            WHOIS_LOOKUPS.inc(source="cache")
+            return hit
+
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.get_running_loop().run_in_executor(self._executor, self._resolve, key, domain)
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda f: self._settle(key, f))
+        else:
+            WHOIS_LOOKUPS.inc(source="inflight")
+        # shielded so one cancelled caller doesn't cancel the lookup for the others
+        return await asyncio.shield(fut)
+
+    def _settle(self, key, fut):
+        self._inflight.pop(key, None)
+        if not fut.cancelled() and fut.exception() is None and fut.result()[0] is not None:
+            self._remember(key, *fut.result())
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_resolver = None
+
+
+async def lookup_company(domain: str) -> tuple[str | None, float | None]:
+    """Cached, non-blocking whois_company() for the scanner pipeline, as CompanyResolver.lookup()."""
+    global _resolver
+    if _resolver is None:
+        _resolver = CompanyResolver()
+    return await _resolver.lookup(domain)
@@ -0,0 +1,214 @@
+# scanner/executor.py
+import os
+import re
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from scanner import detector
+from scanner.metrics import STAGE_SECONDS, RULE_MATCHES, RULE_SECONDS, POOL_RESTARTS
+
+DETECT_PROCESSES = int(os.getenv("DETECT_PROCESSES", str(os.cpu_count() or 1)))
+DETECT_BATCH_BYTES = int(os.getenv("DETECT_BATCH_BYTES", str(256 * 1024)))
+DETECT_BATCH_DELAY = float(os.getenv("DETECT_BATCH_DELAY", "0.005"))
+# bytes of the previous chunk rescanned with the next one, so matches can straddle chunks
+STREAM_OVERLAP = int(os.getenv("STREAM_OVERLAP", "1024"))
+
+# per-process engine, compiled once by _init_worker
+_engine = None
+
+
+def _init_worker(patterns, categories):
+    global _engine
+    _engine = detector.DetectionEngine({name: re.compile(p, flags) for name, (p, flags) in patterns.items()}, categories)
+
+
+def _analyze(data, encoding, headers, remaining, want_title):
+    started = time.perf_counter()
+    html = data.decode(encoding or "utf-8", errors="ignore")
+    rule_seconds = {}
+    found = _engine.find_indices(html, headers, remaining, rule_seconds)
+    title = detector.get_title(html) if want_title else None
+    return {"found": found, "title": title, "seconds": time.perf_counter() - started, "rule_seconds": rule_seconds}
+
+
+def _analyze_batch(items):
+    return [_analyze(*item) for item in items]
+
+
+def _settle(batch, task):
+    for i, (_, fut) in enumerate(batch):
+        if fut.done():
+            continue
+        if task.cancelled():
+            fut.cancel()
+        elif task.exception() is not None:
+            fut.set_exception(task.exception())
+        else:
+            fut.set_result(task.result()[i])
+
+
+class DetectionExecutor:
+    """Runs detection and title parsing in a pool of worker processes.
+
+    Workers compile the current detector.ENGINE rules once at start-up and
+    receive raw body bytes, decoding them on their side. Pages smaller than
+    `batch_bytes` are grouped: they wait up to `batch_delay` seconds (or until
+    `batch_bytes` have piled up) and then go to a worker as one task.
+    processes=0 runs everything in a thread instead.
+
+    If a worker process dies (OOM on a huge page, a segfault) the pool is
+    replaced and the affected tasks are retried once on the new one.
+    """
+
+    def __init__(self, processes=DETECT_PROCESSES, batch_bytes=DETECT_BATCH_BYTES, batch_delay=DETECT_BATCH_DELAY):
+        self.engine = detector.ENGINE
+        self._initargs = ({name: (p.pattern, p.flags) for name, p in zip(self.engine.names, self.engine.patterns)}, self.engine.categories)
+        self.processes = processes
+        self.batch_bytes = batch_bytes
+        self.batch_delay = batch_delay
+        if processes > 0:
+            self._pool = self._new_pool()
+        else:
+            self._pool = None
+            _init_worker(*self._initargs)
+        self._pending = []
+        self._pending_bytes = 0
+        self._timer = None
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.processes, initializer=_init_worker, initargs=self._initargs)
+
+    def _restart(self, broken):
+        # every task that was running on the broken pool ends up here; only the first one replaces it
+        if self._pool is broken:
+            print("[!] A detection worker died; restarting the process pool")
+            POOL_RESTARTS.inc()
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._new_pool()
+
+    async def _run(self, items):
+        if self._pool is None:
+            return await asyncio.to_thread(_analyze_batch, items)
+        loop = asyncio.get_running_loop()
+        pool = self._pool
+        try:
+            return await loop.run_in_executor(pool, _analyze_batch, items)
+        except BrokenProcessPool:
+            self._restart(pool)
+        # a second failure (say, the same page running out of memory again) is the caller's to handle
+        return await loop.run_in_executor(self._pool, _analyze_batch, items)
+
+    async def scan(self, data: bytes, encoding=None, headers=None, remaining=None, want_title=True, batch=True) -> dict:
+        """{"found": matched rule indexes out of `remaining`, "title": title or None} for one body or chunk.
+
+        batch=False sends `data` to a worker right away, whatever its size.
+        """
+        item = (data, encoding, headers or {}, remaining, want_title)
+        if not batch or len(data) >= self.batch_bytes:
+            res = (await self._run([item]))[0]
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            self._pending.append((item, fut))
+            self._pending_bytes += len(data)
+            if self._pending_bytes >= self.batch_bytes:
+                self._dispatch()
+            elif self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.batch_delay, self._dispatch)
+            res = await fut
+        for i, seconds in res["rule_seconds"].items():
+            RULE_SECONDS.inc(seconds, rule=self.engine.names[i])
+        return res
+
+    def _record(self, found, seconds):
+        STAGE_SECONDS.observe(seconds, stage="detect")
+        for i in found:
+            RULE_MATCHES.inc(rule=self.engine.names[i])
+
+    async def analyze(self, body: bytes, encoding: str | None = None, headers: dict | None = None) -> dict:
+        """{"detected": detect() result, "title": page title or None, "seconds": time in detection} for a whole page."""
+        res = await self.scan(body, encoding, headers)
+        self._record(res["found"], res["seconds"])
+        return {"detected": self.engine.group(res["found"]), "title": res["title"], "seconds": res["seconds"]}
+
+    def stream(self, encoding=None, headers=None, overlap=STREAM_OVERLAP):
+        return StreamAnalysis(self, encoding, headers, overlap)
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_bytes = self._pending, [], 0
+        if batch:
+            task = asyncio.ensure_future(self._run([item for item, _ in batch]))
+            task.add_done_callback(lambda t: _settle(batch, t))
+
+    def close(self, wait=False):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+class StreamAnalysis:
+    """analyze() fed one chunk at a time while a body downloads.
+
+    Chunks are gathered until `min_bytes` (the executor's batch_bytes) have
+    arrived and then sent to a worker straight away, not through the batch
+    timer, so small network reads don't each cost a round trip and a wait.
+    Each piece is scanned together with the last `overlap` bytes of the one
+    before, and only for rules not matched yet. `done` turns true once every
+    rule has matched and the title has been seen; nothing later in the body
+    could change the result.
+    """
+
+    def __init__(self, executor, encoding=None, headers=None, overlap=STREAM_OVERLAP, min_bytes=None):
+        self.executor = executor
+        self.encoding = encoding
+        self.overlap = overlap
+        self.min_bytes = executor.batch_bytes if min_bytes is None else min_bytes
+        self.found = set()
+        self.remaining = set(range(len(executor.engine.names)))
+        self.title = None
+        self.seconds = 0.0
+        self._headers = headers
+        self._tail = b""
+        self._pending = bytearray()
+
+    @property
+    def done(self) -> bool:
+        return not self.remaining and self.title is not None
+
+    async def feed(self, chunk: bytes) -> bool:
+        """Add one more chunk, scanning once `min_bytes` have piled up; returns `done`."""
+        self._pending += chunk
+        if len(self._pending) >= self.min_bytes:
+            await self._scan()
+        return self.done
+
+    async def _scan(self):
+        data = self._tail + bytes(self._pending)
+        self._pending = bytearray()
+        res = await self.executor.scan(data, self.encoding, self._headers, frozenset(self.remaining), self.title is None, batch=False)
+        self._headers = None  # headers only need checking once
+        self.found |= res["found"]
+        self.remaining -= res["found"]
+        self.title = self.title or res["title"]
+        self.seconds += res["seconds"]
+        self._tail = data[-self.overlap:]
+
+    async def finish(self) -> dict:
+        if self._pending or self._headers:
+            await self._scan()
+        self.executor._record(self.found, self.seconds)
+        return {"detected": self.executor.engine.group(self.found), "title": self.title, "seconds": self.seconds}
+
+
+_executor = None
+
+
+def get_executor():
+    """Process-wide DetectionExecutor, created on first use (after any load_engine())."""
+    global _executor
+    if _executor is None:
+        _executor = DetectionExecutor()
+    return _executor
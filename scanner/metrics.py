@@ -0,0 +1,170 @@
+# scanner/metrics.py
+"""Process-local counters, gauges and histograms rendered in Prometheus text format."""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REGISTRY = []
+
+
+def _fmt_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_fmt_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Current count for one label set, or the sum over all of them when no labels are given."""
+        with self._lock:
+            if labels or not self.labels:
+                return self._values.get(self._key(labels), 0)
+            return sum(self._values.values())
+
+
+class Gauge(_Metric):
+    """Set directly, or track() a callable that is read at render time."""
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def track(self, fn, **labels):
+        with self._lock:
+            self._functions[self._key(labels)] = fn
+
+    def untrack(self, **labels):
+        with self._lock:
+            self._functions.pop(self._key(labels), None)
+
+    def render(self):
+        with self._lock:
+            functions = list(self._functions.items())
+        for key, fn in functions:
+            try:
+                value = fn()
+            except Exception:
+                continue
+            with self._lock:
+                self._values[key] = value
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        """Observations so far for one label set."""
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+            return counts[-1]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((k, (list(c), t)) for k, (c, t) in self._values.items())
+        for key, (counts, total) in items:
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {counts[-1]}")
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # a line per scrape would drown out the scan log
+
+
+def serve(port, host=""):
+    """Serve render() at /metrics on `port` from a background thread.
+
+    For the runner and queue workers, which record most of the metrics but
+    have no API of their own to expose them.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+STAGE_SECONDS = Histogram("scanner_stage_seconds", "Time spent per scan stage (dns, connect, ttfb, download, detect, whois, db_flush, db_query).", ["stage"])
+DOMAINS = Counter("scanner_domains_total", "Domains scanned, by outcome.", ["outcome"])
+BYTES = Counter("scanner_bytes_total", "Response body bytes downloaded.")
+ERRORS = Counter("scanner_errors_total", "Failed fetches, by error class or HTTP status.", ["error"])
+RULE_MATCHES = Counter("scanner_rule_matches_total", "Pages matched, per detection rule.", ["rule"])
+POOL_RESTARTS = Counter("scanner_detect_pool_restarts_total", "Times the detection process pool was replaced after a worker died.")
+RULE_SECONDS = Counter("scanner_rule_seconds_total", "Time spent evaluating each detection rule beyond the shared prefilter.", ["rule"])
+QUEUE_DEPTH = Gauge("scanner_queue_depth", "Items waiting in each pipeline queue or write buffer.", ["queue"])
+WHOIS_LOOKUPS = Counter("scanner_whois_lookups_total", "Company lookups, by where the answer came from (error: WHOIS failed, nothing cached).", ["source"])
+DB_STATEMENTS = Counter("scanner_db_statements_total", "Statements sent to Postgres by the scanner writers.", ["statement"])
+API_SCANS = Counter("scanner_api_scans_total", "API scan requests, by where the answer came from.", ["source"])
@@ -0,0 +1,191 @@
+# scanner/pipeline.py
+import os
+import time
+import asyncio
+import contextlib
+
+from scanner.crawler import process_domain, make_session
+from scanner.throttle import HostThrottle, HOST_MAX_CONCURRENCY
+from scanner.executor import get_executor
+from scanner.enrich import lookup_company
+from scanner.db import WRITE_BATCH_SIZE, pooled_conn, load_validators
+from scanner.metrics import STAGE_SECONDS, QUEUE_DEPTH
+
+# fetches beyond the throttle's global limit just wait for a slot, so a slow host doesn't idle the rest
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "100"))
+# concurrent submissions to the detection process pool (small pages are batched together)
+DETECT_WORKERS = int(os.getenv("DETECT_WORKERS", "16"))
+ENRICH_WORKERS = int(os.getenv("ENRICH_WORKERS", "4"))
+# each persist worker waits on its ScanWriter future, so allow a full write batch in flight
+PERSIST_WORKERS = int(os.getenv("PERSIST_WORKERS", str(WRITE_BATCH_SIZE)))
+QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "50"))
+
+VALIDATOR_BATCH = 100
+
+_DONE = object()
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _load_validators(domains):
+    started = time.monotonic()
+    try:
+        with pooled_conn() as conn:
+            return load_validators(conn, domains)
+    except Exception as e:
+        print(f"[!] Could not load validators, scanning unconditionally: {e}")
+        return {}
+    finally:
+        STAGE_SECONDS.observe(time.monotonic() - started, stage="db_query")
+
+
+async def _stage(inbox, outbox, handler, workers):
+    """Run `workers` copies of handler over inbox, then signal outbox that this stage is done."""
+
+    async def work():
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                await inbox.put(_DONE)  # let sibling workers see it too
+                return
+            try:
+                item = await handler(item)
+            except Exception as e:
+                # fetch errors come back as results; an exception here is our own failure, not the site's
+                item.update(ok=False, unchanged=False, internal=True, error=f"{type(e).__name__}: {e}")
+                item.pop("body", None)
+            await outbox.put(item)
+
+    await asyncio.gather(*(work() for _ in range(workers)))
+    await outbox.put(_DONE)
+
+
+async def _drain(writer, upstream, persist_stage):
+    """Once nothing new can reach the writer, flush it rather than waiting out its interval."""
+    await upstream
+    while not persist_stage.done():
+        await asyncio.to_thread(writer.flush)
+        await asyncio.sleep(0.05)
+
+
+async def scan_pipeline(
+    domains,
+    writer,
+    fetch_workers=FETCH_WORKERS,
+    detect_workers=DETECT_WORKERS,
+    enrich_workers=ENRICH_WORKERS,
+    persist_workers=PERSIST_WORKERS,
+    queue_size=QUEUE_SIZE,
+    concurrency=HOST_MAX_CONCURRENCY,
+    stream_detect=True,
+    conditional=True,
+    session=None,
+    throttle=None,
+):
+    """Stream domains through fetch → detect → enrich → persist, yielding each result once saved.
+
+    `domains` may be any iterable and is consumed lazily. Every stage hands
+    off through a bounded queue, so at most a few dozen page bodies are held
+    in memory however long the domain list is. With `stream_detect` (the
+    default) detection already happens during the fetch and pages are never
+    held whole; the detect stage then only passes results along.
+
+    With `conditional`, validators from the previous scan are looked up (one
+    query per VALIDATOR_BATCH domains) and sent along. Pages that come back
+    unchanged skip enrichment and only have last_scanned bumped.
+
+    Long-running callers should pass their own `session` and `throttle` so
+    keep-alive connections, the DNS cache and each host's limits and back-off
+    outlive a single call; otherwise both are created here and thrown away.
+    """
+    fetch_q, detect_q, enrich_q, persist_q, out_q = (asyncio.Queue(queue_size) for _ in range(5))
+    executor = get_executor()
+    queues = {"fetch": fetch_q, "detect": detect_q, "enrich": enrich_q, "persist": persist_q, "out": out_q}
+
+    async def produce():
+        for chunk in _chunks(domains, VALIDATOR_BATCH):
+            known = await asyncio.to_thread(_load_validators, chunk) if conditional else {}
+            for domain in chunk:
+                await fetch_q.put({"domain": domain, "validators": known.get(domain)})
+        await fetch_q.put(_DONE)
+
+    async def fetch(item):
+        started = time.monotonic()
+        # detection runs chunk by chunk while the body streams in
+        res = await process_domain(session, item["domain"], executor if stream_detect else None, item["validators"], throttle)
+        res["started"] = started
+        return res
+
+    async def detect_stage(res):
+        if res.get("ok") and "body" in res and not res.get("unchanged"):
+            analysis = await executor.analyze(res.pop("body"), res.pop("encoding"), res.get("headers"))
+            res.setdefault("timings", {})["detect"] = analysis.pop("seconds")
+            res.update(analysis)
+        return res
+
+    async def enrich(res):
+        if res.get("ok") and not res.get("unchanged"):
+            started = time.monotonic()
+            # the original check time goes along, so cached answers still expire on schedule
+            res["company"], res["company_checked_at"] = await lookup_company(res["domain"])
+            res.setdefault("timings", {})["whois"] = time.monotonic() - started
+        return res
+
+    async def persist(res):
+        if res.get("internal"):
+            # nothing is known about the site; saving an error would overwrite its last good scan
+            return res
+        domain = res["domain"]
+        url = res.get("url") or f"https://{domain}"
+        timings = res.setdefault("timings", {})
+        if "started" in res:
+            # fetch start to hand-off to the writer, queue waits included
+            timings["total"] = time.monotonic() - res.pop("started")
+        if res.get("unchanged"):
+            fut = writer.submit(domain, url, "ok", res.get("status"), None, validators=res.get("validators"), unchanged=True,
+                                timings=timings)
+        elif res.get("ok"):
+            detected = res["detected"]
+            fut = writer.submit(
+                domain, url, "ok", res.get("status"), res.get("title"),
+                detected["cms"], detected["js_libs"], detected["analytics"], detected["custom_tags"], detected,
+                company=res.get("company"), company_checked_at=res.get("company_checked_at"),
+                validators=res.get("validators"), timings=timings,
+            )
+        else:
+            res["error"] = res.get("error") or "Unknown fetch error"
+            fut = writer.submit(domain, url, "error", res.get("status"), None, raw={"error": res["error"]}, timings=timings)
+        res["website_id"] = await asyncio.wrap_future(fut)
+        return res
+
+    throttle = throttle or HostThrottle(host_max=concurrency)
+    for name, q in queues.items():
+        QUEUE_DEPTH.track(q.qsize, queue=name)
+    async with (make_session() if session is None else contextlib.nullcontext(session)) as session:
+        tasks = [
+            asyncio.create_task(produce()),
+            asyncio.create_task(_stage(fetch_q, detect_q, fetch, fetch_workers)),
+            asyncio.create_task(_stage(detect_q, enrich_q, detect_stage, detect_workers)),
+            asyncio.create_task(_stage(enrich_q, persist_q, enrich, enrich_workers)),
+            asyncio.create_task(_stage(persist_q, out_q, persist, persist_workers)),
+        ]
+        tasks.append(asyncio.create_task(_drain(writer, tasks[3], tasks[4])))
+        try:
+            while (res := await out_q.get()) is not _DONE:
+                yield res
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for name in queues:
+                QUEUE_DEPTH.untrack(queue=name)
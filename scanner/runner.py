@@ -1,16 +1,22 @@
 import os
-import time
+import sys
 import asyncio
 import tldextract
 from dotenv import load_dotenv
 
-from scanner.crawler import run_scan
-from scanner.detector import detect, get_company
-from scanner.db import get_conn, upsert_website, insert_detection
+from scanner.detector import load_engine
+from scanner.pipeline import scan_pipeline
+from scanner.db import get_conn, pooled_conn, due_for_rescan, ScanWriter
+from scanner.worker import run_worker
+from scanner import metrics
 
 load_dotenv()
 
 DOMAINS_FILE = os.getenv("DOMAINS_FILE", "domains.txt")
+RESCAN_LIMIT = int(os.getenv("RESCAN_LIMIT", "1000"))
+RESCAN_MIN_AGE = int(os.getenv("RESCAN_MIN_AGE", str(86400)))
+# set to expose this process's metrics at http://<host>:METRICS_PORT/metrics
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
 
 
 def normalize_domain(d: str) -> str:
@@ -19,72 +25,69 @@ def normalize_domain(d: str) -> str:
     return ".".join([e.domain, e.suffix]) if not e.subdomain else ".".join([e.subdomain, e.domain, e.suffix])
 
 
-async def scan_domains(domains: list[str]):
-    results = await run_scan(domains, concurrency=3)
-
-    for res in results:
-        domain = res["domain"]
-        url = res.get("url") or f"https://{domain}"
-
-        try:
-            if res.get("ok"):
-                html = res["text"]
-
-                # WHOIS org lookup
-                company_name = get_company(domain)
-
-                # Run detection
-                detected = detect(html, res.get("headers", {}))
-
-                # Save to DB
-                def save_success():
-                    conn = get_conn()
-                    wid = upsert_website(conn, domain, url, "ok", res.get("status"), None)
-                    insert_detection(
-                        conn,
-                        wid,
-                        detected["cms"],
-                        detected["js_libs"],
-                        detected["analytics"],
-                        detected["custom_tags"],
-                        detected,
-                    )
-                    conn.close()
-                    return wid
-
-                wid = await asyncio.to_thread(save_success)
-                print(f"🌍 {domain} ✅ Detected {len(detected['raw'])} techs → Website ID {wid}")
-
+def iter_domains(path: str):
+    """Yield normalized domains from a file one line at a time."""
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield normalize_domain(line.strip())
+
+
+async def scan_domains(domains):
+    count = 0
+    with ScanWriter() as writer:
+        async for res in scan_pipeline(domains, writer):
+            count += 1
+            domain = res["domain"]
+            if res.get("unchanged"):
+                print(f"🌍 {domain} ⏸ Unchanged → Website ID {res['website_id']}")
+            elif res.get("ok"):
+                print(f"🌍 {domain} ✅ Detected {len(res['detected']['raw'])} techs → Website ID {res['website_id']}")
+            elif res.get("website_id"):
+                print(f"🌍 {domain} ❌ Error: {res['error']} → Website ID {res['website_id']}")
             else:
-                error_msg = res.get("error", "Unknown fetch error")
+                print(f"❌ Error handling {domain}: {res['error']}")
+    return count
 
-                def save_error():
-                    conn = get_conn()
-                    wid = upsert_website(conn, domain, url, "error", res.get("status"), None)
-                    insert_detection(conn, wid, [], [], [], [], {"error": error_msg})
-                    conn.close()
-                    return wid
 
-                wid = await asyncio.to_thread(save_error)
-                print(f"🌍 {domain} ❌ Error: {error_msg} → Website ID {wid}")
-
-        except Exception as e:
-            print(f"❌ Error handling {domain}: {e}")
-
-        time.sleep(1)  # avoid hammering
+def due_domains(limit=RESCAN_LIMIT, min_age=RESCAN_MIN_AGE):
+    """Known websites in freshness-scheduler order (see db.due_for_rescan)."""
+    with pooled_conn() as conn:
+        return due_for_rescan(conn, limit, min_age)
 
 
 def main():
-    if not os.path.exists(DOMAINS_FILE):
+    worker = "--worker" in sys.argv[1:]
+    rescan = "--rescan" in sys.argv[1:]
+    if not (worker or rescan) and not os.path.exists(DOMAINS_FILE):
         print(f"❌ Domains file {DOMAINS_FILE} not found.")
         return
 
-    with open(DOMAINS_FILE, "r") as f:
-        domains = [normalize_domain(line.strip()) for line in f if line.strip()]
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+        print(f"📈 Metrics on :{METRICS_PORT}/metrics")
+
+    try:
+        conn = get_conn()
+        load_engine(conn)
+        conn.close()
+    except Exception as e:
+        print(f"[!] Using built-in detection rules: {e}")
+
+    if worker:
+        asyncio.run(run_worker(normalize=normalize_domain))
+        return
+
+    if rescan:
+        domains = due_domains()
+        print(f"🔁 Re-scanning {len(domains)} websites")
+        count = asyncio.run(scan_domains(domains))
+        print(f"✅ Re-scan complete ({count} domains).")
+        return
 
-    print(f"🚀 Starting batch scan for {len(domains)} domains")
-    asyncio.run(scan_domains(domains))
-    print("✅ All scans complete.")
+    print(f"🚀 Starting batch scan of {DOMAINS_FILE}")
+    count = asyncio.run(scan_domains(iter_domains(DOMAINS_FILE)))
+    print(f"✅ All scans complete ({count} domains).")
 
 
 if __name__ == "__main__":
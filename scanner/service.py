@@ -0,0 +1,154 @@
+# scanner/service.py
+import os
+import time
+import asyncio
+from collections import OrderedDict
+
+from scanner.crawler import process_domain, make_session
+from scanner.throttle import HostThrottle
+from scanner.executor import get_executor
+from scanner.db import get_writer, pooled_conn
+from scanner.metrics import STAGE_SECONDS, API_SCANS
+
+SCAN_CACHE_TTL = float(os.getenv("SCAN_CACHE_TTL", "3600"))
+SCAN_ERROR_TTL = float(os.getenv("SCAN_ERROR_TTL", "60"))
+SCAN_CACHE_SIZE = int(os.getenv("SCAN_CACHE_SIZE", "10000"))
+
+
+class ScanService:
+    """On-demand scans for the API, sharing one HTTP session for the app's lifetime.
+
+    Results come from an in-process LRU, then from the latest detections row
+    (if the site was scanned within `ttl`), and only then from a new scan.
+    Concurrent requests for the same domain share one scan. Failed scans are
+    cached too, for `error_ttl`, so a dead site isn't refetched on every
+    request.
+    """
+
+    def __init__(self, ttl=SCAN_CACHE_TTL, error_ttl=SCAN_ERROR_TTL, maxsize=SCAN_CACHE_SIZE, use_db=True):
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.maxsize = maxsize
+        self.use_db = use_db
+        self.session = None
+        self.throttle = None
+        self._cache = OrderedDict()
+        self._inflight = {}
+
+    async def start(self):
+        self.session = make_session()
+        self.throttle = HostThrottle()
+
+    async def close(self):
+        for fut in list(self._inflight.values()):
+            fut.cancel()
+        if self.session is not None:
+            await self.session.close()
+
+    def _ttl_for(self, result):
+        return self.ttl if result["status"] == "ok" else self.error_ttl
+
+    def _cached(self, domain):
+        hit = self._cache.get(domain)
+        if hit is None:
+            return None
+        result, expires = hit
+        if expires < time.monotonic():
+            del self._cache[domain]
+            return None
+        self._cache.move_to_end(domain)
+        return result
+
+    def _remember(self, domain, result, age=0.0):
+        self._cache[domain] = (result, time.monotonic() + self._ttl_for(result) - age)
+        self._cache.move_to_end(domain)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def _from_db(self, domain):
+        """Latest stored result for `domain` and its age in seconds, or None."""
+        with pooled_conn() as conn, conn.cursor() as cur:
+            # unchanged re-scans only bump last_scanned, so the newest detection still describes the page
+            cur.execute("""
+                SELECT w.id, w.url, w.status, d.raw, EXTRACT(EPOCH FROM now() - w.last_scanned)
+                FROM websites w
+                JOIN LATERAL (
+                    SELECT raw FROM detections WHERE website_id = w.id ORDER BY detected_at DESC LIMIT 1
+                ) d ON true
+                WHERE w.domain = %s
+            """, (domain,))
+            row = cur.fetchone()
+        if row is None:
+            return None
+        wid, url, status, raw, age = row
+        result = {"domain": domain, "url": url, "status": status, "website_id": wid}
+        if status == "ok":
+            result["detected"] = raw
+        else:
+            result["error"] = (raw or {}).get("error") or "Unknown fetch error"
+        age = float(age)
+        return (result, age) if age < self._ttl_for(result) else None
+
+    async def scan(self, domain: str, fresh=False) -> dict:
+        """/api/scan response for `domain`, with "cached": True when no new fetch was made for it.
+
+        fresh=True skips the cache and the database, but still joins a scan
+        already in flight.
+        """
+        domain = domain.lower()
+        if not fresh:
+            result = self._cached(domain)
+            if result is not None:
+                API_SCANS.inc(source="cache")
+                return {**result, "cached": True}
+            if self.use_db:
+                started = time.monotonic()
+                try:
+                    stored = await asyncio.to_thread(self._from_db, domain)
+                except Exception as e:
+                    print(f"[!] stored scan lookup failed for {domain}: {e}")
+                    stored = None
+                finally:
+                    STAGE_SECONDS.observe(time.monotonic() - started, stage="db_query")
+                if stored is not None:
+                    API_SCANS.inc(source="db")
+                    self._remember(domain, *stored)
+                    return {**stored[0], "cached": True}
+
+        fut = self._inflight.get(domain)
+        if fut is None:
+            API_SCANS.inc(source="scan")
+            fut = asyncio.ensure_future(self._scan(domain))
+            self._inflight[domain] = fut
+            fut.add_done_callback(lambda f: self._settle(domain, f))
+        else:
+            API_SCANS.inc(source="inflight")
+        # shielded so a disconnecting client doesn't cancel the scan for everyone else
+        result = await asyncio.shield(fut)
+        return {**result, "cached": False}
+
+    def _settle(self, domain, fut):
+        self._inflight.pop(domain, None)
+        if not fut.cancelled() and fut.exception() is None:
+            self._remember(domain, fut.result())
+
+    async def _scan(self, domain):
+        res = await process_domain(self.session, domain, get_executor(), throttle=self.throttle)
+        url = res.get("url") or f"https://{domain}"
+        writer = get_writer()
+
+        if res.get("ok"):
+            detected = res["detected"]
+            fut = writer.submit(domain, url, "ok", res.get("status"), res.get("title"),
+                                detected["cms"], detected["js_libs"], detected["analytics"], detected["custom_tags"], detected,
+                                validators=res.get("validators"), timings=res.get("timings"))
+            result = {"domain": domain, "url": url, "status": "ok", "detected": detected}
+        else:
+            error_msg = res.get("error") or "Unknown fetch error"
+            fut = writer.submit(domain, url, "error", res.get("status"), None, raw={"error": error_msg}, timings=res.get("timings"))
+            result = {"domain": domain, "url": url, "status": "error", "error": error_msg}
+
+        # don't wait out the writer's flush interval for one scan
+        await asyncio.to_thread(writer.flush)
+        result["website_id"] = await asyncio.wrap_future(fut)
+        return result
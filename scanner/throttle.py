@@ -0,0 +1,135 @@
+# scanner/throttle.py
+import os
+import time
+import asyncio
+from email.utils import parsedate_to_datetime
+
+GLOBAL_CONCURRENCY = int(os.getenv("GLOBAL_CONCURRENCY", "50"))
+HOST_MAX_CONCURRENCY = int(os.getenv("HOST_MAX_CONCURRENCY", "3"))
+HOST_RATE = float(os.getenv("HOST_RATE", "2.0"))  # requests per second per host, sustained
+HOST_BURST = float(os.getenv("HOST_BURST", "3"))
+SLOW_LATENCY = float(os.getenv("SLOW_LATENCY", "5.0"))  # seconds to first byte that count as overload
+MAX_RETRY_AFTER = float(os.getenv("MAX_RETRY_AFTER", "60"))
+BACKOFF = float(os.getenv("THROTTLE_BACKOFF", "2.0"))
+OVERLOADED = {429, 503}
+
+
+def retry_after_seconds(value) -> float | None:
+    """Retry-After as seconds, whether given as a delay or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _Host:
+    __slots__ = ("limit", "active", "tokens", "refilled", "blocked_until", "strikes", "cond")
+
+    def __init__(self, limit, burst):
+        self.limit = limit
+        self.active = 0
+        self.tokens = burst
+        self.refilled = time.monotonic()
+        self.blocked_until = 0.0
+        self.strikes = 0
+        self.cond = asyncio.Condition()
+
+
+class HostThrottle:
+    """Global concurrency cap plus an adaptive limit and token bucket per host.
+
+    Each host's concurrency limit follows AIMD: it grows by 1/limit after
+    every fast success and halves on a timeout, connection error, 429/503 or
+    a response slower than `slow_latency`. 429/503 also block the host for
+    its Retry-After (capped at `max_retry_after`), or for an exponential
+    backoff when there is none. The token bucket spaces requests to the
+    same host at `rate` per second with bursts of `burst`.
+    """
+
+    def __init__(self, global_limit=GLOBAL_CONCURRENCY, host_max=HOST_MAX_CONCURRENCY, rate=HOST_RATE, burst=HOST_BURST,
+                 slow_latency=SLOW_LATENCY, max_retry_after=MAX_RETRY_AFTER, backoff=BACKOFF):
+        self.host_max = host_max
+        self.rate = rate
+        self.burst = burst
+        self.slow_latency = slow_latency
+        self.max_retry_after = max_retry_after
+        self.backoff = backoff
+        self._global = asyncio.Semaphore(global_limit)
+        self._hosts = {}
+
+    def _host(self, host):
+        h = self._hosts.get(host)
+        if h is None:
+            if len(self._hosts) > 10000:
+                self._prune()
+            h = self._hosts[host] = _Host(min(2, self.host_max), self.burst)
+        return h
+
+    def _prune(self):
+        now = time.monotonic()
+        for host, h in list(self._hosts.items()):
+            if h.active == 0 and h.blocked_until <= now:
+                del self._hosts[host]
+
+    def _wait_time(self, h, now):
+        h.tokens = min(self.burst, h.tokens + (now - h.refilled) * self.rate)
+        h.refilled = now
+        if h.blocked_until > now:
+            return h.blocked_until - now
+        if h.tokens < 1:
+            return (1 - h.tokens) / self.rate
+        if h.active >= int(h.limit):
+            return None  # woken by release()
+        return 0.0
+
+    async def acquire(self, host):
+        h = self._host(host)
+        async with h.cond:
+            while (wait := self._wait_time(h, time.monotonic())) != 0.0:
+                try:
+                    await asyncio.wait_for(h.cond.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+            h.active += 1
+            h.tokens -= 1
+        try:
+            await self._global.acquire()
+        except BaseException:
+            async with h.cond:
+                h.active -= 1
+                h.cond.notify_all()
+            raise
+
+    async def release(self, host, status=None, latency=None, retry_after=None):
+        """Give back the slot taken by acquire() and adapt the host's limit to what happened.
+
+        status=None means the request failed without a response (timeout, DNS, reset).
+        """
+        self._global.release()
+        h = self._host(host)
+        now = time.monotonic()
+        async with h.cond:
+            h.active -= 1
+            if status is None or status in OVERLOADED:
+                h.limit = max(1.0, h.limit / 2)
+                h.strikes += 1
+                if status in OVERLOADED:
+                    delay = retry_after_seconds(retry_after)
+                    if delay is None:
+                        delay = self.backoff * 2 ** (h.strikes - 1)
+                    h.blocked_until = max(h.blocked_until, now + min(delay, self.max_retry_after))
+            elif latency is not None and latency > self.slow_latency:
+                h.limit = max(1.0, h.limit / 2)
+            else:
+                h.limit = min(float(self.host_max), h.limit + 1 / h.limit)
+                h.strikes = 0
+            h.cond.notify_all()
+
+    def limit(self, host) -> float:
+        return self._host(host).limit
@@ -0,0 +1,151 @@
+# scanner/worker.py
+import os
+import socket
+import uuid
+import asyncio
+
+from scanner.db import get_conn, pooled_conn, ScanWriter
+from scanner.crawler import make_session
+from scanner.throttle import HostThrottle
+from scanner.pipeline import scan_pipeline
+
+QUEUE_BATCH_SIZE = int(os.getenv("QUEUE_BATCH_SIZE", "20"))
+QUEUE_LEASE_SECONDS = int(os.getenv("QUEUE_LEASE_SECONDS", "300"))
+QUEUE_POLL_SECONDS = float(os.getenv("QUEUE_POLL_SECONDS", "30"))
+# claims before a row whose scan keeps failing internally is saved as an error and dropped
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "3"))
+QUEUE_CHANNEL = "scan_queue"
+
+
+def claim_batch(worker_id, limit=QUEUE_BATCH_SIZE, lease=QUEUE_LEASE_SECONDS):
+    """Lease up to `limit` unprocessed rows nobody else holds (or whose lease ran out).
+
+    Returns (id, domain, attempts), attempts counting this claim.
+    """
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            UPDATE scan_queue SET claimed_by = %s, claimed_at = now(), attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM scan_queue
+                WHERE processed = false
+                  AND (claimed_at IS NULL OR claimed_at < now() - make_interval(secs => %s))
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, domain, attempts
+        """, (worker_id, lease, limit))
+        return cur.fetchall()
+
+
+def renew_lease(worker_id, ids):
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            UPDATE scan_queue SET claimed_at = now()
+            WHERE id = ANY(%s) AND claimed_by = %s AND processed = false
+        """, (list(ids), worker_id))
+
+
+def mark_processed(worker_id, ids):
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            UPDATE scan_queue SET processed = true, processed_at = now()
+            WHERE id = ANY(%s) AND claimed_by = %s
+        """, (list(ids), worker_id))
+
+
+def _listen():
+    conn = get_conn()
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"LISTEN {QUEUE_CHANNEL}")
+    return conn
+
+
+async def _wait_for_notify(conn, timeout):
+    """Sleep until a scan_queue NOTIFY arrives or `timeout` passes (expired leases need a poll)."""
+    loop = asyncio.get_running_loop()
+    woken = asyncio.Event()
+    loop.add_reader(conn.fileno(), woken.set)
+    try:
+        await asyncio.wait_for(woken.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        loop.remove_reader(conn.fileno())
+    conn.poll()
+    conn.notifies.clear()
+
+
+async def _keep_leased(worker_id, ids, lease):
+    while True:
+        await asyncio.sleep(lease / 3)
+        try:
+            await asyncio.to_thread(renew_lease, worker_id, ids)
+        except Exception as e:
+            print(f"[!] Lease renewal failed: {e}")
+
+
+async def process_batch(rows, writer, worker_id, lease=QUEUE_LEASE_SECONDS, normalize=lambda d: d, session=None, throttle=None,
+                        max_attempts=QUEUE_MAX_ATTEMPTS):
+    """Scan claimed rows and mark the ones that got saved as processed.
+
+    A scan that fails internally (nothing saved) is left leased and retried
+    once the lease runs out, up to `max_attempts` claims; after that an
+    error is saved for the site and the row is marked processed.
+    """
+    ids_by_domain, attempts = {}, {}
+    for qid, domain, tries in rows:
+        domain = normalize(domain.strip())
+        ids_by_domain.setdefault(domain, []).append(qid)
+        attempts[domain] = max(attempts.get(domain, 0), tries)
+
+    done = []
+    heartbeat = asyncio.create_task(_keep_leased(worker_id, [qid for qid, _, _ in rows], lease))
+    try:
+        async for res in scan_pipeline(list(ids_by_domain), writer, session=session, throttle=throttle):
+            domain = res["domain"]
+            if res.get("website_id") is None:
+                if attempts[domain] < max_attempts:
+                    # not saved: leave it leased so it's retried once the lease runs out
+                    print(f"❌ Error handling {domain} (attempt {attempts[domain]}): {res.get('error')}")
+                    continue
+                error = f"Gave up after {attempts[domain]} attempts: {res.get('error')}"
+                fut = writer.submit(domain, res.get("url") or f"https://{domain}", "error", None, None, raw={"error": error})
+                res.update(ok=False, error=error, website_id=await asyncio.wrap_future(fut))
+            done.extend(ids_by_domain[domain])
+            status = "✅" if res.get("ok") else f"❌ {res.get('error')}"
+            print(f"🌍 {domain} {status} → Website ID {res['website_id']}")
+    finally:
+        heartbeat.cancel()
+        if done:
+            await asyncio.to_thread(mark_processed, worker_id, done)
+    return len(done)
+
+
+async def run_worker(batch_size=QUEUE_BATCH_SIZE, lease=QUEUE_LEASE_SECONDS, poll=QUEUE_POLL_SECONDS, normalize=lambda d: d):
+    """Consume scan_queue forever. Any number of workers may run against the same database."""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    listener = None
+    print(f"👷 Worker {worker_id} consuming {QUEUE_CHANNEL}")
+
+    # one session and throttle for the worker's lifetime: keep-alive connections, the DNS
+    # cache and every host's limit and Retry-After carry over from one batch to the next
+    throttle = HostThrottle()
+    with ScanWriter() as writer:
+        async with make_session() as session:
+            while True:
+                try:
+                    if listener is None or listener.closed:
+                        listener = await asyncio.to_thread(_listen)
+                    rows = await asyncio.to_thread(claim_batch, worker_id, batch_size, lease)
+                    if rows:
+                        await process_batch(rows, writer, worker_id, lease, normalize, session, throttle)
+                    else:
+                        await _wait_for_notify(listener, poll)
+                except Exception as e:
+                    print(f"[!] Worker error: {e}")
+                    if listener is not None:
+                        listener.close()
+                        listener = None
+                    await asyncio.sleep(poll)
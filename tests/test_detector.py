@@ -0,0 +1,116 @@
+# tests/test_detector.py
+"""DetectionEngine has to find exactly what running every regex on its own finds.
+
+Its prefilter is derived from the private re parser (re._parser / sre_parse),
+so a Python upgrade that changes that parser should fail here instead of
+quietly changing detections.
+"""
+import json
+import random
+import re
+from pathlib import Path
+
+import pytest
+
+from scanner.detector import TECH_PATTERNS, DetectionEngine
+
+CORPUS = Path(__file__).resolve().parent.parent / "bench" / "corpus"
+
+# rules like the ones technologies.pattern can hold: partial literals, classes, anchors, no literal at all
+DB_PATTERNS = {
+    "WP paths": re.compile(r"wp-(content|includes)/", re.I),
+    "GTM id": re.compile(r"gtm\.js\?id=GTM-[A-Z0-9]+", re.I),
+    "Shopify CDN": re.compile(r"[a-z0-9-]+\.myshopify\.com", re.I),
+    "Colour": re.compile(r"colou?r-scheme", re.I),
+    "Word": re.compile(r"\bember\b", re.I),
+    "Doctype": re.compile(r"^<!doctype html", re.I),
+    "Data attr": re.compile(r"data-[a-z]+-id", re.I),
+    "Anything": re.compile(r"a{2,}|z+q", re.I),
+    "Case-sensitive": re.compile(r"KUBE|k8s"),
+    "Long s": re.compile(r"ſtripe", re.I),
+    "Optional tail": re.compile(r"jquery(\.min)?\.js", re.I),
+}
+
+# what detect() returned for the built-in rules before the engine existed
+ORIGINAL_GROUPS = {
+    "cms": ["WordPress", "Drupal", "Joomla", "Shopify"],
+    "js_libs": ["React", "Vue.js", "Angular", "Next.js", "Svelte", "Ember.js", "jQuery"],
+    "analytics": ["Google Analytics"],
+    "custom_tags": ["Stripe", "PayPal", "Cloudflare", "Akamai", "Fastly"],
+}
+
+# fragments the fuzz cases are glued together from
+TOKENS = [
+    "wp-content", "wordpress", "WordPress", "wp-", "press", "drupal", "shopify", "myshopify.com", "react", "REACT",
+    "vue", "vue.js", ".js", "_next", "svelte", "ember", "embers", "jquery.min.js", "jquery", "bootstrap",
+    "tailwind", "googletagmanager", "gtag(", "gtm.js?id=GTM-AB12", "analytics.js", "stripe", "ſtripe", "paypal",
+    "cloudflare", "aKamai", "fastly", ".php", "django", "flask", "laravel", "colour-scheme", "color-scheme",
+    "data-shop-id", "<!DOCTYPE html>", "aa", "zzq", "KUBE", "kube", "k8s", "İ", "ı", "ſ", "K", "é", "中",
+    " ", "\n", "<", ">", "/", "-", ".", "(", "?", "=", "x", "s", "i",
+]
+
+
+def reference(patterns, html, headers=None):
+    """The original detect() loop: each rule's regex over the body, then over every header value."""
+    return [name for name, pattern in patterns.items()
+            if pattern.search(html) or (headers and any(pattern.search(str(v)) for v in headers.values()))]
+
+
+def corpus_pages():
+    pages = json.loads((CORPUS / "pages.json").read_text())
+    return [((CORPUS / page["file"]).read_text(errors="ignore"), page.get("headers")) for page in pages]
+
+
+def fuzz_cases(n, seed=1234):
+    rng = random.Random(seed)
+    cases = []
+    for _ in range(n):
+        html = "".join(rng.choice(TOKENS) for _ in range(rng.randint(0, 12)))
+        headers = None
+        if rng.random() < 0.3:
+            headers = {f"X-{k}": "".join(rng.choice(TOKENS) for _ in range(rng.randint(0, 4))) for k in range(rng.randint(1, 3))}
+        cases.append((html, headers))
+    return cases
+
+
+CASES = corpus_pages() + [
+    ("", None),
+    ("WP-CONTENT", None),
+    ("wordpreſs", None),   # ſ folds to s under re.I
+    ("aKamai", None),      # Kelvin sign folds to k
+    ("İmage", {"Server": "cloudflare"}),
+    ("<script>gtag(</script>", {"X-Powered-By": "PHP/8.1"}),
+] + fuzz_cases(3000)
+
+
+@pytest.mark.parametrize("patterns", [TECH_PATTERNS, {**TECH_PATTERNS, **DB_PATTERNS}], ids=["builtin", "builtin+db"])
+def test_engine_matches_every_regex_run_alone(patterns):
+    engine = DetectionEngine(patterns)
+    for html, headers in CASES:
+        assert engine.find(html, headers) == reference(patterns, html, headers), (html, headers)
+
+
+def test_engine_respects_remaining():
+    patterns = {**TECH_PATTERNS, **DB_PATTERNS}
+    engine = DetectionEngine(patterns)
+    rng = random.Random(99)
+    for html, headers in CASES[:500]:
+        remaining = set(rng.sample(range(len(engine.names)), rng.randint(0, len(engine.names))))
+        expected = {engine.names.index(name) for name in reference(patterns, html, headers)} & remaining
+        assert engine.find_indices(html, headers, remaining) == expected, (html, headers)
+
+
+def test_builtin_detect_result_unchanged():
+    engine = DetectionEngine(TECH_PATTERNS)
+    for html, headers in CASES:
+        found = reference(TECH_PATTERNS, html, headers)
+        expected = {key: [t for t in found if t in names] for key, names in ORIGINAL_GROUPS.items()}
+        expected["raw"] = found
+        assert engine.detect(html, headers) == expected
+
+
+def test_builtin_rules_all_use_the_prefilter():
+    # if the parser walk stops understanding plain patterns, every rule falls back to a full regex scan
+    engine = DetectionEngine(TECH_PATTERNS)
+    assert not engine.unfiltered
+    assert {engine.names[i] for i in engine.exact} >= {"WordPress", "React", "jQuery", "Google Analytics"}